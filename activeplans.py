@@ -19,6 +19,7 @@ import sys
 
 from argparse import ArgumentParser
 from collections import namedtuple, defaultdict
+from course_mapper_paths import reports_dir
 from getch import getch, getche
 from pathlib import Path
 from psycopg.rows import namedtuple_row
@@ -26,15 +27,10 @@ from quarantine_manager import QuarantineManager
 
 quarantined_dict = QuarantineManager()
 
-home_dir = Path.home()
-error_file = Path(home_dir,
-                  'Projects/course_mapper/reports/activeplans_err.txt').open(mode='w')
-inactive_file = Path(home_dir,
-                     'Projects/course_mapper/reports/inactive.txt').open(mode='w')
-log_file = Path(home_dir,
-                'Projects/course_mapper/reports/activeplans_log.txt').open(mode='w')
-missing_file = Path(home_dir,
-                    'Projects/course_mapper/reports/activeplans_missing.txt').open(mode='w')
+error_file = Path(reports_dir, 'activeplans_err.txt').open(mode='w')
+inactive_file = Path(reports_dir, 'inactive.txt').open(mode='w')
+log_file = Path(reports_dir, 'activeplans_log.txt').open(mode='w')
+missing_file = Path(reports_dir, 'activeplans_missing.txt').open(mode='w')
 
 
 # RHS for plan and subplan dicts
@@ -107,6 +103,9 @@ with psycopg.connect('dbname=cuny_curriculum') as conn:
       else:
         row_dict = row._asdict()
         del row_dict['term_info']
+        # These strings are used as keys over and over during mapping
+        row_dict['institution'] = sys.intern(row.institution)
+        row_dict['requirement_id'] = sys.intern(row.requirement_id)
         row_dict['first_active_term'] = min_active_term
         row_dict['last_active_term'] = max_active_term
         row_dict['num_recent_active_terms'] = num_recent_active_terms
@@ -119,7 +118,7 @@ with psycopg.connect('dbname=cuny_curriculum') as conn:
       from cuny_acad_plan_tbl
     """)
     all_acad_plans = {(row.institution, row.plan):
-                      PlanInfo._make([row.plan,
+                      PlanInfo._make([sys.intern(row.plan),
                                       row.plan_type,
                                       row.description,
                                       str(row.effective_date),
@@ -132,7 +131,7 @@ with psycopg.connect('dbname=cuny_curriculum') as conn:
       from cuny_acad_subplan_tbl
     """)
     all_acad_subplans = {(row.institution, row.plan, row.subplan):
-                         SubplanInfo._make([row.subplan,
+                         SubplanInfo._make([sys.intern(row.subplan),
                                             row.subplan_type,
                                             row.description,
                                             str(row.effective_date),
@@ -179,7 +178,7 @@ def active_plans():
             from requirement_blocks
            where institution = %s
              and block_value = %s
-             and period_stop ~* '^9'
+             and period_stop like '9%%'
           """, (row.institution, row.plan))
 
           # Collect the active blocks; ignore others
@@ -216,7 +215,7 @@ def active_plans():
                  where institution = %s
                    and block_type = 'CONC'
                    and block_value = %s
-                   and period_stop ~* '^9'
+                   and period_stop like '9%%'
                 """, (row.institution, subplan_name))
 
                 if req_block_cursor.rowcount == 0:
@@ -3,346 +3,593 @@
 
 import csv
 import datetime
-import os
 import json
 import psycopg
 import re
 import sys
-import traceback
 
 from activeplans import active_plans
 from argparse import ArgumentParser
 from catalogyears import catalog_years
-from collections import namedtuple, defaultdict
-from copy import copy, deepcopy
-from coursescache import courses_cache
+from collections import Counter, namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import count
 from dgw_parser import parse_block
-from psycopg.rows import namedtuple_row, dict_row
+from multiprocessing import get_context
+from psycopg.rows import dict_row
 from quarantine_manager import QuarantineManager
-from recordclass import recordclass
-from traceback import extract_stack
 from typing import Any
 
 from course_mapper_files import anomaly_file, blocks_file, conditions_file, fail_file, log_file, \
     no_courses_file, subplans_file, todo_file, programs_file, requirements_file, mapping_file, \
-    label_file
+    label_file, report_files
 
-from course_mapper_utils import format_group_description, get_parse_tree, get_restrictions, \
-    header_classcredit, header_maxtransfer, header_minres, header_mingpa, header_mingrade, \
-    header_maxclass, header_maxcredit, header_maxpassfail, header_maxperdisc, header_minclass, \
-    header_mincredit, header_minperdisc, header_proxyadvice, letter_grade, mogrify_context_list, \
-    mogrify_course_list, mogrify_expression, number_names, number_ordinals, context_conditions
+from course_mapper_utils import close_curriculum_db, curriculum_db, format_group_description, \
+    get_parse_tree, get_restrictions, header_classcredit, header_maxtransfer, header_minres, \
+    header_mingpa, header_mingrade, header_maxclass, header_maxcredit, header_maxpassfail, \
+    header_maxperdisc, header_minclass, header_mincredit, header_minperdisc, mogrify_context_list, \
+    mogrify_course_list, number_names, number_ordinals, context_conditions
+
+from load_mapping_tables import copy_into_table, create_tables, finish_tables
 
 
 programs_writer = csv.writer(programs_file)
 requirements_writer = csv.writer(requirements_file)
 map_writer = csv.writer(mapping_file)
 
+# Rows for the programs, requirements, and mapping tables are buffered and written in batches.
+ROW_BUFFER_SIZE = 1024
+program_rows = []
+requirement_rows = []
+map_rows = []
+
+# Worker processes (--workers) return their rows to the main process instead of writing them.
+is_worker = False
+
 generated_date = str(datetime.date.today())
 
-requirement_key = 0
+# Connection for copying rows directly into the course_mapper tables (--copy_to_db)
+db_conn = None
+
+# Compact JSON encoder for the CSV columns that get loaded into jsonb columns
+json_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+# The header_dict lists (and other dict) that go into the JSON columns of the programs table
+program_header_cols = ['total_credits_list', 'maxtransfer_list', 'minres_list', 'mingrade_list',
+                       'mingpa_list', 'other']
+
+# Body requirements that are only logged, and the (node id, institution, requirement_id) of the ones
+# already handled in each containing block. Parse trees are cached for the whole run, so a node's id
+# identifies it. See traverse_body().
+log_only_requirements = frozenset(['noncourse', 'proxy_advice', 'rule_complete'])
+log_only_nodes = set()
+
+# Active requirement_blocks rows, keyed by institution, block_type, block_value, and current_only:
+# see lookup_blocks()
+requirement_blocks_cache = dict()
+
+# Current requirement_blocks rows for copy_rules targets, keyed by (institution, requirement_id):
+# see copy_rules_target()
+copy_rules_targets = dict()
+
+# Catalog years strings, keyed by (period_start, period_stop): see catalog_years_text()
+catalog_years_strs = dict()
+
+# Cached JSON encodings of block_info context elements: see encode_context()
+block_info_encodings = dict()
+
+# Placeholders that can appear in requirement names
+coursetitle_re = re.compile(r'<coursetitle>', re.I)
+coursecredits_re = re.compile(r'<coursecredits>', re.I)
+
+# Concentrations named in blocktype conditions, and the digits/punctuation that get removed from
+# group requirement labels
+concentration_re = re.compile(r'CON == (\S+)')
+digits_punct_re = re.compile(r'[\d,:]+')
+# Words that don’t count as part of a group requirement’s name
+group_ignore_words = frozenset(number_names + ['and', 'area', 'areas', 'choose', 'following',
+                                               'from', 'group', 'groups', 'module', 'modules',
+                                               'of', 'option', 'options', 'or', 'select',
+                                               'selected', 'selct', 'slect', 'sequence',
+                                               'sequences', 'set', 'study', 'the'])
+
+# Source of requirement_keys
+requirement_keys = count(1)
 
 quarantine_manager = QuarantineManager()
 
-program_blocks_list = []
+# Blocks already entered in the programs table
+program_blocks = set()
+# For each plan, keyed by (institution, requirement_id), a dict of its subplan_dicts, keyed by the
+# subplans’ requirement_ids
+subplan_indexes = dict()
 reference_counts = defaultdict(int)
 reference_callers = defaultdict(list)
+# Whether to record where process_block() was called from for each block (--debug)
+record_callers = False
 Reference = namedtuple('Reference', 'name lineno')
+make_reference = Reference._make
+ConditionalFrame = namedtuple('ConditionalFrame',
+                              'condition_str tagged_true_lists tagged_false_lists items')
+
+# Header items that have handlers: the function that processes the item, and the list that the
+# function's result gets appended to. Used both for the header list and for header conditionals.
+header_handlers = {'header_class_credit': (header_classcredit, 'total_credits_list'),
+                   'header_maxtransfer': (header_maxtransfer, 'maxtransfer_list'),
+                   'header_minres': (header_minres, 'minres_list'),
+                   'header_mingpa': (header_mingpa, 'mingpa_list'),
+                   'header_mingrade': (header_mingrade, 'mingrade_list'),
+                   'header_maxclass': (header_maxclass, 'maxclass_list'),
+                   'header_maxcredit': (header_maxcredit, 'maxcredit_list'),
+                   'header_maxpassfail': (header_maxpassfail, 'maxpassfail_list'),
+                   'header_maxperdisc': (header_maxperdisc, 'maxperdisc_list'),
+                   'header_minclass': (header_minclass, 'minclass_list'),
+                   'header_mincredit': (header_mincredit, 'mincredit_list'),
+                   'header_minperdisc': (header_minperdisc, 'minperdisc_list')}
+# Other header items that can appear in a conditional
+header_conditional_others = ['conditional', 'header_share', 'proxyadvice']
+# Header items that are intentionally ignored: there are no course requirements or restrictions to
+# report for these.
+header_ignored_keys = {'header_lastres', 'header_maxterm', 'header_minterm', 'lastres', 'noncourse',
+                       'optional', 'rule_complete', 'standalone', 'header_share', 'header_tag',
+                       'under'}
+# Subset qualifiers and rules that are intentionally ignored.
+subset_ignored_keys = frozenset(['maxpassfail', 'maxperdisc', 'mingpa', 'minspread', 'noncourse',
+                                 'share'])
+
+# Functions that make the dicts marking the legs and end of a conditional, given its condition_str.
+# The condition_str in verbose endif markers is for verification, not logically needed. Main selects
+# the concise markers if --concise_conditionals.
+ConditionalMarkers = namedtuple('ConditionalMarkers', 'begin_true begin_false endif')
+verbose_markers = ConditionalMarkers._make([lambda condition_str: {'if_true': condition_str},
+                                            lambda condition_str: {'if_false': condition_str},
+                                            lambda condition_str: {'endif': condition_str}])
+concise_markers = ConditionalMarkers._make([lambda condition_str: {'if': condition_str},
+                                            lambda condition_str: {'else': ''},
+                                            lambda condition_str: {'endif': ''}])
+conditional_markers = verbose_markers
+
+# Whether to log each header item, including conditional items, processed (--no_header_log turns
+# this off)
+log_header_items = True
 
 
 # =================================================================================================
 
+# catalog_years_text()
+# -------------------------------------------------------------------------------------------------
+def catalog_years_text(period_start: str, period_stop: str) -> str:
+  """Return the catalog years string for a block’s period.
+
+  Most blocks share a small number of periods, so each period’s string is generated just once.
+  """
+  try:
+    return catalog_years_strs[(period_start, period_stop)]
+  except KeyError:
+    text = catalog_years(period_start, period_stop).text
+    catalog_years_strs[(period_start, period_stop)] = text
+    return text
+
+
+# copy_rows()
+# -------------------------------------------------------------------------------------------------
+def copy_rows(table_name: str, rows: list):
+  """Copy rows into one of the course_mapper schema tables, if --copy_to_db was specified."""
+  if db_conn is None:
+    return
+
+  def write_rows(copy: psycopg.Copy):
+    for row in rows:
+      copy.write_row(row)
+
+  with db_conn.cursor() as cursor:
+    copy_into_table(cursor, table_name, write_rows)
+
+
+# copy_rules_refs()
+# -------------------------------------------------------------------------------------------------
+def copy_rules_refs(node: Any):
+  """Generate the target requirement_ids of all copy_rules clauses in (part of) a parse tree."""
+  if isinstance(node, list):
+    for item in node:
+      yield from copy_rules_refs(item)
+  elif isinstance(node, dict):
+    for key, value in node.items():
+      if key == 'copy_rules' and isinstance(value, dict) and 'requirement_id' in value:
+        yield value['requirement_id']
+      else:
+        yield from copy_rules_refs(value)
+
+
+# copy_rules_target()
+# -------------------------------------------------------------------------------------------------
+def copy_rules_target(institution: str, target_requirement_id: str) -> dict | None:
+  """Return the requirement_id, block_title, and parse_tree of the target of a copy_rules.
+
+  Returns None unless there is exactly one current block with the target requirement_id. The same
+  targets get copied by many blocks, so each is looked up, and parsed if necessary, just once; see
+  prefetch_copy_rules_targets(). Only the body_list (or error) of the parse_tree is kept: copy_rules
+  doesn’t use the header.
+  """
+  target_key = (institution, target_requirement_id)
+  try:
+    return copy_rules_targets[target_key]
+  except KeyError:
+    prefetch_copy_rules_targets(institution, [target_requirement_id])
+    return copy_rules_targets[target_key]
+
+
+# encode_context()
+# -------------------------------------------------------------------------------------------------
+def encode_context(context_list: list) -> str:
+  """JSON-encode a context_list, reusing the encodings of block_info elements seen before.
+
+  All the requirements in a block share the block’s block_info dict, so its encoding is cached,
+  keyed by the dict’s id. The entries are removed once the dicts leave the context (see
+  process_one_block() and process_block()), so an id can’t be reused while it is cached. The only
+  part of a block_info that changes after it is created is the reference counts of a plan’s
+  subplans, so those counts tell whether a cached encoding is still valid.
+  """
+  parts = []
+  for element in context_list:
+    block_info = element.get('block_info')
+    if block_info is None or len(element) != 1:
+      parts.append(json_encode(element))
+      continue
+
+    if plan_info := block_info.get('plan_info'):
+      version = tuple(subplan['subplan_reference_count'] for subplan in plan_info['subplans'])
+    else:
+      version = None
+    cached = block_info_encodings.get(id(block_info))
+    if cached is None or cached[0] != version:
+      cached = (version, json_encode(element))
+      block_info_encodings[id(block_info)] = cached
+    parts.append(cached[1])
+
+  return f'[{",".join(parts)}]'
+
+
+# extended_context()
+# -------------------------------------------------------------------------------------------------
+@contextmanager
+def extended_context(context_list: list, *context_parts: list):
+  """Extend the context_list in place for the duration of a with statement.
+
+  Whatever gets added to the context_list inside the with statement (body remarks extend it) is
+  trimmed off again at the end, as if a copy of the extended list had been used.
+  """
+  context_len = len(context_list)
+  for context_part in context_parts:
+    context_list += context_part
+  try:
+    yield context_list
+  finally:
+    del context_list[context_len:]
+
+
+# flush_rows()
+# -------------------------------------------------------------------------------------------------
+def flush_rows(force: bool = False):
+  """Write buffered programs, requirement, and mapping rows when a buffer is full, or if forced.
+
+  All buffers are written together, requirement rows before mapping rows, so the requirements table
+  is always at least as complete as the mappings that refer to it.
+  """
+  if is_worker:
+    return
+  if force or max(len(program_rows), len(requirement_rows), len(map_rows)) >= ROW_BUFFER_SIZE:
+    if program_rows:
+      programs_writer.writerows(program_rows)
+      copy_rows('dgw_programs', program_rows)
+      program_rows.clear()
+    if requirement_rows:
+      requirements_writer.writerows(requirement_rows)
+      copy_rows('dgw_requirements', requirement_rows)
+      requirement_rows.clear()
+    if map_rows:
+      map_writer.writerows(map_rows)
+      copy_rows('dgw_courses', map_rows)
+      map_rows.clear()
+
+
+# init_worker()
+# -------------------------------------------------------------------------------------------------
+def init_worker():
+  """Set up a worker process for mapping plans in parallel.
+
+  Rows are collected for the main process to write. Report lines are written as they are printed
+  so lines from different workers don’t get split up, and don’t get lost when the worker exits. Each
+  worker gets its own connection to the curriculum db.
+  """
+  global is_worker
+  is_worker = True
+  curriculum_db(reconnect=True)
+  for report_file in report_files:
+    report_file.reconfigure(line_buffering=True)
+
+
+# log_label()
+# -------------------------------------------------------------------------------------------------
+def log_label(institution: str, requirement_id: str, requirement_value: dict) -> str | None:
+  """Log a requirement’s label, if it has one, and return it."""
+  label_str = requirement_value.get('label')
+  if label_str is not None:
+    print(f'{institution} {requirement_id} {label_str}', file=label_file)
+  return label_str
+
+
+# lookup_blocks()
+# -------------------------------------------------------------------------------------------------
+def lookup_blocks(institution: str, block_type: str, block_value: str,
+                  current_only: bool = False) -> list:
+  """Return the active requirement_blocks rows for a block type and value, as a list of dicts.
+
+  The same blocks get referenced over and over by different programs, so the rows for each lookup
+  are cached; see prefetch_blocks(). If current_only, the blocks must also be current (period_stop
+  99999999).
+  """
+  lookup_key = (institution, block_type, block_value, current_only)
+  try:
+    return requirement_blocks_cache[lookup_key]
+  except KeyError:
+    pass
+
+  prefetch_blocks([(institution, block_type, block_value)], current_only)
+  return requirement_blocks_cache[lookup_key]
+
+
+# plan_subplan_index()
+# -------------------------------------------------------------------------------------------------
+def plan_subplan_index(plan_block_info: dict) -> dict:
+  """Return the plan’s subplan_dicts, keyed by the subplans’ requirement_ids.
+
+  The index is keyed by the plan block’s own institution, which is not necessarily the institution
+  of a nested block that gets here through a body block reference.
+  """
+  plan_key = (plan_block_info['institution'], plan_block_info['requirement_id'])
+  try:
+    return subplan_indexes[plan_key]
+  except KeyError:
+    subplan_index = {subplan['subplan_block_info']['requirement_id']: subplan
+                     for subplan in plan_block_info['plan_info']['subplans']}
+    subplan_indexes[plan_key] = subplan_index
+    return subplan_index
+
+
+# prefetch_blocks()
+# -------------------------------------------------------------------------------------------------
+def prefetch_blocks(block_keys: list, current_only: bool = False):
+  """Look up the active requirement_blocks rows for a list of (institution, block_type, block_value)
+  keys with a single query, and add them to the lookup_blocks() cache.
+
+  Keys that are already cached are not looked up again; keys with no active blocks get cached as
+  empty lists.
+  """
+  new_keys = {block_key for block_key in block_keys
+              if (*block_key, current_only) not in requirement_blocks_cache}
+  if not new_keys:
+    return
+
+  for block_key in new_keys:
+    requirement_blocks_cache[(*block_key, current_only)] = []
+  institutions, block_types, block_values = zip(*new_keys)
+  current_clause = "and period_stop like '9%%'" if current_only else ''
+  with curriculum_db().cursor(row_factory=dict_row) as cursor:
+    cursor.execute(f"""
+    select institution, requirement_id, block_type, block_value, title as block_title,
+           period_start, period_stop, major1
+      from requirement_blocks
+     where term_info is not null
+       and (institution, block_type, block_value) in (select * from unnest(%s::text[],
+                                                                           %s::text[],
+                                                                           %s::text[]))
+       {current_clause}
+    """, (list(institutions), list(block_types), list(block_values)), prepare=True)
+    for row in cursor:
+      lookup_key = (row['institution'], row['block_type'], row['block_value'], current_only)
+      requirement_blocks_cache[lookup_key].append(row)
+
+
+# prefetch_copy_rules_targets()
+# -------------------------------------------------------------------------------------------------
+def prefetch_copy_rules_targets(institution: str, target_requirement_ids: Any):
+  """Look up the copy_rules targets for a collection of requirement_ids at an institution with a
+  single query, and add them to the copy_rules_target() cache.
+
+  Targets can themselves copy rules from other blocks, so the bodies of the targets found are
+  scanned in turn, and their targets are looked up too, one query per level of copying.
+  """
+  new_ids = {target_requirement_id for target_requirement_id in target_requirement_ids
+             if (institution, target_requirement_id) not in copy_rules_targets}
+  while new_ids:
+    target_rows = defaultdict(list)
+    with curriculum_db().cursor(row_factory=dict_row) as cursor:
+      cursor.execute("""
+      select institution, requirement_id, block_type, block_value, title as block_title,
+             period_start, period_stop, parse_tree
+        from requirement_blocks
+       where institution = %s
+         and requirement_id = any(%s)
+         and period_stop like '9%%'
+      """, (institution, list(new_ids)), prepare=True)
+      for row in cursor:
+        target_rows[row['requirement_id']].append(row)
+
+    next_ids = set()
+    for target_requirement_id in new_ids:
+      row = None
+      if len(target_rows[target_requirement_id]) == 1:
+        row = target_rows[target_requirement_id][0]
+        parse_tree = row['parse_tree']
+        if not parse_tree:
+          # Not expecting to do this. (The column is jsonb: an unparsed block's tree comes back as
+          # an empty dict or None, never as the string '{}'.)
+          print(f'{institution} {target_requirement_id} Parse copy_rules target', file=log_file)
+          parse_tree = parse_block(institution, target_requirement_id,
+                                   row['period_start'], row['period_stop'])
+        row = {'requirement_id': row['requirement_id'],
+               'block_title': row['block_title'],
+               'parse_tree': {key: parse_tree[key] for key in ['error', 'body_list']
+                              if key in parse_tree}}
+        next_ids.update(copy_rules_refs(row['parse_tree'].get('body_list', [])))
+      copy_rules_targets[(institution, target_requirement_id)] = row
+
+    new_ids = {target_requirement_id for target_requirement_id in next_ids
+               if (institution, target_requirement_id) not in copy_rules_targets}
+
+
+# map_plan()
+# -------------------------------------------------------------------------------------------------
+def map_plan(acad_plan: dict) -> tuple:
+  """Process a plan in a worker process, and return the programs, requirements, and mapping rows."""
+  process_block(acad_plan['requirement_block'], context_list=[], plan_dict=acad_plan)
+  plan_rows = (program_rows.copy(), requirement_rows.copy(), map_rows.copy())
+  program_rows.clear()
+  requirement_rows.clear()
+  map_rows.clear()
+  return plan_rows
+
+
+# add_plan_rows()
+# -------------------------------------------------------------------------------------------------
+def add_plan_rows(plan_program_rows: list, plan_requirement_rows: list, plan_map_rows: list):
+  """Write the rows returned by a worker process.
+
+  Each worker numbers its requirements independently, so they get renumbered here. Blocks shared
+  by plans processed by different workers are entered in the programs table just once.
+  """
+  for program_row in plan_program_rows:
+    program_key = (program_row[0], program_row[1])
+    if program_key not in program_blocks:
+      program_blocks.add(program_key)
+      program_rows.append(program_row)
+
+  requirement_key_map = dict()
+  for requirement_row in plan_requirement_rows:
+    requirement_key = next(requirement_keys)
+    requirement_key_map[requirement_row[6]] = requirement_key
+    requirement_row[6] = requirement_key
+  for map_row in plan_map_rows:
+    map_row[0] = requirement_key_map[map_row[0]]
+
+  requirement_rows.extend(plan_requirement_rows)
+  map_rows.extend(plan_map_rows)
+  flush_rows()
+
+
 # header_conditional()
 # -------------------------------------------------------------------------------------------------
 def header_conditional(institution: str, requirement_id: str,
                        return_dict: dict, conditional_dict: dict):
-  """Update return_dict with conditions found by traversing the conditional_dict recursively."""
-  # The header columns that might be updated:
+  """Update return_dict with conditions found by traversing the conditional_dict.
+
+  Nested conditionals are traversed using an explicit stack of ConditionalFrames rather than by
+  recursion. The frame on top of the stack is the innermost conditional being traversed.
+  """
+  # The header columns that might be updated; all other lists are in the Other column.
   column_lists = ['total_credits_list', 'maxtransfer_list',
                   'minres_list', 'mingrade_list', 'mingpa_list']
 
-  # The lists in the Other column that might be updated:
-  other_lists = ['total_credits_list', 'maxcredit_list', 'maxtransfer_list',
-                 'minclass_list', 'mincredit_list', 'minres_list', 'mingrade_list', 'mingpa_list']
-
-  condition_str = conditional_dict['conditional']['condition_str']
-  tagged_true_lists = []
-  tagged_false_lists = []
-
   # Possible values for which_leg
   true_leg = True
   false_leg = False
 
-  def tag(which_list, which_leg=true_leg):
-    """Manage the first is_true and, possibly, is_false for each list."""
-    if args.concise_conditionals:
-      which_dict = {'if': condition_str} if which_leg else {'else': ''}
-    else:
-      which_dict = {'if_true': condition_str} if which_leg else {'if_false': condition_str}
-
-    if which_leg == true_leg and which_list not in tagged_true_lists:
-      tagged_true_lists.append(which_list)
-      if which_list in column_lists:
-        return_dict[which_list].append(which_dict)
-      elif which_list in other_lists:
-        return_dict['other'][which_list].append(which_dict)
-      else:
-        exit(f'{which_list} is not in column_lists or other_lists')
-
-    if which_leg == false_leg and which_list not in tagged_false_lists:
-      tagged_false_lists.append(which_list)
-      if which_list in column_lists:
-        return_dict[which_list].append(which_dict)
-      elif which_list in other_lists:
-        return_dict['other'][which_list].append(which_dict)
-      else:
-        exit(f'{which_list} is not in column_lists or other_lists')
-
-  # True leg handlers
-  # -----------------
-  if true_dict := conditional_dict['conditional']['if_true']:
-    for requirement in true_dict:
-      for key, value in requirement.items():
-        match key:
-
-          case 'conditional':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            header_conditional(institution, requirement_id, return_dict, requirement)
-
-          case 'header_class_credit':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('total_credits_list', true_leg)
-            return_dict['total_credits_list'].append(header_classcredit(institution, requirement_id,
-                                                                        value, do_proxyadvice))
-
-          case 'header_maxtransfer':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('maxtransfer_list', true_leg)
-            return_dict['maxtransfer_list'].append(header_maxtransfer(institution, requirement_id,
-                                                                      value))
-
-          case 'header_minres':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('minres_list', true_leg)
-            return_dict['minres_list'].append(header_minres(institution, requirement_id, value))
-
-          case 'header_mingpa':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('mingpa_list', true_leg)
-            return_dict['mingpa_list'].append(header_mingpa(institution, requirement_id, value))
-
-          case 'header_mingrade':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('mingrade_list', true_leg)
-            return_dict['mingrade_list'].append(header_mingrade(institution, requirement_id, value))
-
-          case 'header_maxclass':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('maxclass_list', true_leg)
-            return_dict['other']['maxclass_list'].append(header_maxclass(institution,
-                                                                         requirement_id, value))
-
-          case 'header_maxcredit':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('maxcredit_list', true_leg)
-            return_dict['other']['maxcredit_list'].append(header_maxcredit(institution,
-                                                                           requirement_id, value))
-
-          case 'header_maxpassfail':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('maxpassfail_list', true_leg)
-            return_dict['other']['maxpassfail_list'].append(header_maxpassfail(institution,
-                                                                               requirement_id,
-                                                                               value))
-
-          case 'header_maxperdisc':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('maxperdisc_list', true_leg)
-            return_dict['other']['maxperdisc_list'].append(header_maxperdisc(institution,
-                                                                             requirement_id, value))
-
-          case 'header_minclass':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('minclass_list', true_leg)
-            return_dict['other']['minclass_list'].append(header_minclass(institution,
-                                                                         requirement_id, value))
-
-          case 'header_mincredit':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('mincredit_list', true_leg)
-            return_dict['other']['mincredit_list'].append(header_mincredit(institution,
-                                                                           requirement_id, value))
-
-          case 'header_minperdisc':
-            print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-            tag('minperdisc_list', true_leg)
-            return_dict['other']['minperdisc_list'].append(header_minperdisc(institution,
-                                                                             requirement_id, value))
-
-          case 'header_share':
-            # Ignore
-            pass
+  def header_list(which_list):
+    """Return the list, either a column or part of the Other column, to be updated."""
+    if which_list in column_lists:
+      return return_dict[which_list]
+    return return_dict['other'][which_list]
 
-          case 'proxyadvice':
-            if do_proxy_advice:
-              print(f'{institution} {requirement_id} Header conditional true {key}', file=log_file)
-              tag('proxyadvice_list', true_leg)
-              return_dict['other']['proxyadvice_list'].append(value)
-            else:
-              print(f'{institution} {requirement_id} Header conditional true {key} (ignored)',
-                    file=log_file)
-              pass
+  def leg_items(conditional: dict):
+    """Generate the items in the true and false (else) legs of a conditional.
 
-          case _:
-            print(f'{institution} {requirement_id} Conditional-true {key} not implemented (yet)',
-                  file=todo_file)
+    The false leg is optional.
+    """
+    for which_leg, leg_key in [(true_leg, 'if_true'), (false_leg, 'if_false')]:
+      for requirement in conditional.get(leg_key) or []:
+        for key, value in requirement.items():
+          yield which_leg, key, value, requirement
 
-  # False (else) leg handlers
-  # -------------------------
-  try:
-    false_dict = conditional_dict['conditional']['if_false']
-    for requirement in false_dict:
-      for key, value in requirement.items():
-        match key:
-
-          case 'conditional':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            header_conditional(institution, requirement_id, return_dict, requirement)
-
-          case 'header_class_credit':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('total_credits_list', false_leg)
-            return_dict['total_credits_list'].append(header_classcredit(institution,
-                                                                        requirement_id,
-                                                                        value, do_proxyadvice))
-
-          case 'header_maxtransfer':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('maxtransfer_list', false_leg)
-            return_dict['maxtransfer_list'].append(header_maxtransfer(institution, requirement_id,
-                                                                      value))
-
-          case 'header_minres':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('minres_list', false_leg)
-            return_dict['minres_list'].append(header_minres(institution, requirement_id, value))
-
-          case 'header_mingpa':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('mingpa_list', false_leg)
-            return_dict['mingpa_list'].append(header_mingpa(institution, requirement_id, value))
-
-          case 'header_mingrade':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('mingrade_list', false_leg)
-            return_dict['mingrade_list'].append(header_mingrade(institution, requirement_id,
-                                                                value))
-
-          case 'header_maxclass':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('maxclass_list', false_leg)
-            return_dict['other']['maxclass_list'].append(header_maxclass(institution,
-                                                                         requirement_id, value))
-
-          case 'header_maxcredit':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('maxcredit_list', false_leg)
-            return_dict['other']['maxcredit_list'].append(header_maxcredit(institution,
-                                                                           requirement_id, value))
-
-          case 'header_maxpassfail':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('maxpassfail_list', false_leg)
-            return_dict['other']['maxpassfail_list'].append(header_maxpassfail(institution,
-                                                                               requirement_id,
-                                                                               value))
-
-          case 'header_maxperdisc':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('maxperdisc_list', false_leg)
-            return_dict['other']['maxperdisc_list'].append(header_maxperdisc(institution,
-                                                                             requirement_id,
-                                                                             value))
-
-          case 'header_minclass':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('minclass_list', false_leg)
-            return_dict['other']['minclass_list'].append(header_minclass(institution,
-                                                                         requirement_id, value))
-
-          case 'header_mincredit':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('mincredit_list', false_leg)
-            return_dict['other']['mincredit_list'].append(header_mincredit(institution,
-                                                                           requirement_id,
-                                                                           value))
-
-          case 'header_minperdisc':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            tag('minperdisc_list', false_leg)
-            return_dict['other']['minperdisc_list'].append(header_minperdisc(institution,
-                                                                             requirement_id,
-                                                                             value))
-
-          case 'header_share':
-            print(f'{institution} {requirement_id} Header conditional false {key}', file=log_file)
-            # Ignore
-            pass
+  def push_frame(conditional: dict):
+    """Start traversing a conditional."""
+    stack.append(ConditionalFrame._make([conditional['condition_str'], [], [],
+                                         leg_items(conditional)]))
 
-          case 'proxyadvice':
-            if do_proxy_advice:
-              print(f'{institution} {requirement_id} Header conditional true {key}',
-                    file=log_file)
-              tag('proxyadvice_list', false_leg)
-              return_dict['other']['proxyadvice_list'].append(value)
-            else:
-              print(f'{institution} {requirement_id} Header conditional true {key} (ignored)',
-                    file=log_file)
-              pass
+  def tag(frame, which_list, which_leg=true_leg):
+    """Manage the first is_true and, possibly, is_false for each list."""
+    if which_leg == true_leg:
+      tagged_lists, begin_marker = frame.tagged_true_lists, conditional_markers.begin_true
+    else:
+      tagged_lists, begin_marker = frame.tagged_false_lists, conditional_markers.begin_false
+    if which_list not in tagged_lists:
+      tagged_lists.append(which_list)
+      header_list(which_list).append(begin_marker(frame.condition_str))
+
+  stack = []
+  push_frame(conditional_dict['conditional'])
+  while stack:
+    frame = stack[-1]
+    try:
+      which_leg, key, value, requirement = next(frame.items)
+    except StopIteration:
+      # Mark the end of this conditional.
+      for tagged_list in frame.tagged_true_lists:
+        header_list(tagged_list).append(conditional_markers.endif(frame.condition_str))
+      stack.pop()
+      continue
+
+    leg_str = 'true' if which_leg else 'false'
+    if key not in header_handlers and key not in header_conditional_others:
+      print(f'{institution} {requirement_id} Conditional-{leg_str} {key} not implemented (yet)',
+            file=todo_file)
+      continue
+
+    # All recognized items are logged from here
+    if log_header_items:
+      is_ignored = key == 'header_share' or (key == 'proxyadvice' and not do_proxyadvice)
+      ignored_str = ' (ignored)' if is_ignored else ''
+      print(f'{institution} {requirement_id} Header conditional {leg_str} {key}{ignored_str}',
+            file=log_file)
+
+    if key in header_handlers:
+      handler, which_list = header_handlers[key]
+      tag(frame, which_list, which_leg)
+      if handler is header_classcredit:
+        header_list(which_list).append(handler(institution, requirement_id,
+                                               value, do_proxyadvice))
+      else:
+        header_list(which_list).append(handler(institution, requirement_id, value))
 
-          case _:
-            print(f'{institution} {requirement_id} Conditional-false {key} not implemented (yet)',
-                  file=todo_file)
-  except KeyError:
-    # False part is optional
-    pass
+    elif key == 'conditional':
+      # Nested conditional: finish it before continuing with this one
+      push_frame(requirement['conditional'])
 
-  # Mark the end of this conditional. The condition_str is for verification, not logically needed.
-  if args.concise_conditionals:
-    condition_str = ''
-  for tagged_list in tagged_true_lists:
-    if tagged_list in column_lists:
-      return_dict[tagged_list].append({'endif': condition_str})
-    else:
-      return_dict['other'][tagged_list].append({'endif': condition_str})
+    elif key == 'proxyadvice' and do_proxyadvice:
+      tag(frame, 'proxyadvice_list', which_leg)
+      header_list('proxyadvice_list').append(value)
+
+    # header_share (and proxyadvice when not wanted) is ignored
 
 
 # body_conditional()
 # -------------------------------------------------------------------------------------------------
 def body_conditional(institution: str, requirement_id: str,
                      context_list: list, conditional_dict: dict):
-  """
-      Update the return_dict with conditional info determined by traversing the conditional_dict
-      recursively.
-  """
+  """Traverse the true and false (else) legs of a body conditional.
 
+  The leg's condition is pushed onto the context_list while the leg is being traversed. The false
+  leg is optional.
+  """
   condition_str = conditional_dict['condition_str']
-  begin_true = {'if': condition_str} if args.concise_conditionals else {'if_true': condition_str}
-  begin_false = {'else': ''} if args.concise_conditionals else {'if_false': condition_str}
-
-  if true_dict := conditional_dict['if_true']:
-    context_list.append(begin_true)
-    traverse_body(true_dict, context_list)
-    context_list.pop()
+  begin_true = conditional_markers.begin_true(condition_str)
+  begin_false = conditional_markers.begin_false(condition_str)
 
-  try:
-   false_dict = conditional_dict['if_false']
-   context_list.append(begin_false)
-   traverse_body(false_dict, context_list)
-   context_list.pop()
-  except KeyError as err:
-    # false leg is optional
-    pass
+  for begin_dict, leg_key in [(begin_true, 'if_true'), (begin_false, 'if_false')]:
+    if leg_list := conditional_dict.get(leg_key):
+      with extended_context(context_list, [begin_dict]):
+        traverse_body(leg_list, context_list)
 
 
 # map_courses()
@@ -376,8 +623,7 @@ def map_courses(institution: str, requirement_ids: str, block_title: str, contex
       Requirement Key, Course ID, Career, Course, With
   """
   # The requirement_key is used to join the requirements and the courses that map to them.
-  global requirement_key
-  requirement_key += 1
+  requirement_key = next(requirement_keys)
 
   # conditions_str = context_conditions(context_list)
   # if conditions_str:
@@ -394,104 +640,128 @@ def map_courses(institution: str, requirement_ids: str, block_title: str, contex
   # requirement_id that matches one of this plan’s subplan’s requirement_ids.
 
   # First, are there any enclosing contexts that might be for a subplan?
-  plan_block, *other_blocks = requirement_ids.split(':', maxsplit=1)
-  enclosing_requirement_ids = []
-  for context_item in context_list[1:]:
-    try:
-      enclosing_requirement_ids.append(context_item['block_info']['requirement_id'])
-    except KeyError:
-      pass
+  plan_block, *other_blocks = requirement_ids.split(':')
+  # The block where this requirement was found
+  last_block = other_blocks[-1] if other_blocks else plan_block
+  enclosing_requirement_ids = {context_item['block_info']['requirement_id']
+                               for context_item in context_list[1:] if 'block_info' in context_item}
+  # With no enclosing blocks, this has to be a requirement for the plan.
+  subplan_name = ''
   if enclosing_requirement_ids:
-    # Search this plan’s subplans for a requirement_id that matches one of the enclosing blocks.
+    # Search this plan’s subplans, in plan order, for one that is among the enclosing blocks.
     for subplan in plan_info['subplans']:
       if subplan['subplan_block_info']['requirement_id'] in enclosing_requirement_ids:
         subplan_name = subplan['subplan_name']
         break
     else:
-      # There are enclosing contexts, and plan has subplans, but no subplan matches any of the
-      # enclosing blocks, so this has to be a requirement for the plan.
-      print(f'{institution} {plan_block} Block(s) {other_blocks} not subplan of the plan.',
-            file=subplans_file)
-      subplan_name = ''
-  else:
-    # There is no enclosing context, so this has to be a requirement for the plan.
-    subplan_name = ''
-
-  # Copy the requirement_dict in case a local version has to be constructed
-  requirement_info = deepcopy(requirement_dict)
-  try:
-    course_list = requirement_info['course_list']
-  except KeyError:
+      # There are enclosing contexts, but no subplan matches any of the enclosing blocks, so this
+      # has to be a requirement for the plan.
+      print(f"{institution} {plan_block} Block(s) {requirement_ids.split(':', maxsplit=1)[1:]} "
+            f"not subplan of the plan.", file=subplans_file)
+
+  # Shallow copy: only top-level keys (label, num_courses) get replaced here; nested values are
+  # shared with requirement_dict, and are only read downstream.
+  requirement_info = dict(requirement_dict)
+  if (course_list := requirement_info.get('course_list')) is None:
     # Sometimes the course_list _is_ the requirement. In these cases, all scribed courses are
     # (assumed to be) required. So create a requirement_info dict with a set of values to reflect
     # this.
-    course_list = requirement_dict
-    num_scribed = sum([len(area) for area in course_list['scribed_courses']])
+    # Ignore context_path provided by dgw_parser, if it is present. (It just makes the course list
+    # harder to read)
+    course_list = {key: value for key, value in requirement_dict.items() if key != 'context_path'}
+    num_scribed = sum(map(len, course_list['scribed_courses']))
     requirement_info = {'label': 'Unnamed Requirement',
                         'conjunction': None,
-                        'course_list': requirement_dict,
+                        'course_list': course_list,
                         'max_classes': num_scribed,
                         'max_credits': None,
                         'min_classes': num_scribed,
                         'min_credits': None,
                         'allow_classes': None,
                         'allow_credits': None}
-    try:
-      # Ignore context_path provided by dgw_parser, if it is present. (It just makes the course list
-      # harder to read)
-      del course_list['context_path']
-    except KeyError:
-      pass
 
   # Put the course_list into "canonical form"
-  canonical_course_list = mogrify_course_list(institution, requirement_ids[-1], course_list)
+  canonical_course_list = mogrify_course_list(institution, last_block, course_list)
   requirement_info['num_courses'] = len(canonical_course_list)
   if requirement_info['num_courses'] == 0:
-    print(institution, requirement_ids[-1], file=no_courses_file)
+    print(institution, last_block, file=no_courses_file)
   else:
     # Map all the courses for the requirement ...
-    for course_info in canonical_course_list:
-      row = [requirement_key,
-             course_info.course_id_str,
-             course_info.career,
-             course_info.course_str,
-             json.dumps(course_info.with_clause, ensure_ascii=False),
-             generated_date]
-      map_writer.writerow(row)
+    encode = json_encode
+    map_rows.extend([requirement_key,
+                     course_info.course_id_str,
+                     course_info.career,
+                     course_info.course_str,
+                     encode(course_info.with_clause),
+                     generated_date]
+                    for course_info in canonical_course_list)
 
     # ... and add the requirement to the requirements table
     requirement_name = requirement_info['label']
     """ Check requirement name for <COURSETITLE> & <COURSECREDITS> """
     # Title and credits come from first course listed if there are multiple courses
     course_info = canonical_course_list[0]
-    if '<COURSETITLE>' in requirement_name.upper():
-      # course_info.course_str is "discipline catalog_number: title" (title might contain colons)
-      _, course_title = course_info.course_str.split(':', 1)
-      course_title = course_title.strip()
-      requirement_name = re.sub(r'<coursetitle>', course_title, requirement_name,
-                                flags=re.I)
-    if '<COURSECREDITS>' in requirement_name.upper():
-      requirement_name = re.sub(r'<courscredits>', course_info.credits, requirement_name,
-                                flags=re.I)
+    if '<' in requirement_name:
+      if coursetitle_re.search(requirement_name):
+        # course_info.course_str is "discipline catalog_number: title" (title might contain colons)
+        _, course_title = course_info.course_str.split(':', 1)
+        course_title = course_title.strip()
+        requirement_name = coursetitle_re.sub(lambda _: course_title, requirement_name)
+      requirement_name = coursecredits_re.sub(lambda _: str(course_info.credits), requirement_name)
 
     context_list[-1]['requirement_name'] = requirement_name
     requirement_info['label'] = requirement_name
 
+    # Encode the context with this requirement at its end without copying the context_list
+    context_list.append({'requirement': requirement_info})
+    try:
+      context_str = encode_context(context_list)
+    finally:
+      context_list.pop()
+
     requirement_row = [institution, plan_name, plan_type, subplan_name, requirement_ids,
-                       conditions, requirement_key, block_title,
-                       json.dumps(context_list + [{'requirement': requirement_info}],
-                                  ensure_ascii=False),
-                       generated_date]
+                       conditions, requirement_key, block_title, context_str, generated_date]
 
-    requirements_writer.writerow(requirement_row)
+    requirement_rows.append(requirement_row)
+    flush_rows()
 
 
 # process_block()
 # =================================================================================================
 def process_block(block_info: dict,
-                  context_list: list = [],
+                  context_list: list = None,
                   plan_dict: dict = None):
-  """Process a dap_req_block.
+  """Process a dap_req_block, and then any blocks it leaves to be processed afterwards.
+
+  Blocks left for later (a plan’s un-referenced subplans) are kept on an explicit work stack rather
+  than being processed by recursive calls. Blocks referenced from the body of a block are still
+  processed as they are encountered, because the plan’s subplan reference counts depend on them.
+  """
+  if context_list is None:
+    context_list = []
+  caller_frame = sys._getframe(1) if record_callers else None
+  work_stack = [(block_info, context_list, plan_dict)]
+  is_later_block = False
+  while work_stack:
+    block_info, context_list, plan_dict = work_stack.pop()
+    later_blocks = process_one_block(block_info, context_list, plan_dict, caller_frame)
+    if is_later_block:
+      # A later block’s context is the (already processed) plan’s block_info_dict, whose encoding
+      # got cached again while the later block was processed.
+      for context_item in context_list:
+        block_info_encodings.pop(id(context_item['block_info']), None)
+    is_later_block = True
+    # Process the later blocks in the order they were listed
+    work_stack.extend(reversed(later_blocks))
+    caller_frame = sys._getframe(0) if record_callers else None
+
+
+# process_one_block()
+# -------------------------------------------------------------------------------------------------
+def process_one_block(block_info: dict, context_list: list, plan_dict: dict,
+                      caller_frame: Any) -> list:
+  """Process a dap_req_block, and return a list of (block_info, context_list, plan_dict) tuples for
+  blocks to be processed after it.
 
   The block will be for:
     - An academic plan (major or minor)
@@ -508,34 +778,35 @@ def process_block(block_info: dict,
     to the list of “others” references for the plan.
 
     Orphans are subplans (concentrations) that are never referenced by its plan’s requirements. Once
-    the plan block has been processed, any orphans are processed.
+    the plan block has been processed, any orphans are returned to process_block() to be processed.
+    caller_frame is where process_block() was called from, if record_callers is set.
   """
-  institution = block_info['institution']
-  requirement_id = block_info['requirement_id']
+  # Blocks referenced from other blocks come straight from queries, so intern their keys here: the
+  # same strings are used as keys in several dicts over and over.
+  institution = sys.intern(block_info['institution'])
+  requirement_id = sys.intern(block_info['requirement_id'])
   dap_req_block_key = (institution, requirement_id)
   reference_counts[dap_req_block_key] += 1
 
-  caller_frame = traceback.extract_stack()[-2]
-  reference_callers[dap_req_block_key].append((Reference._make((caller_frame.name,
-                                                                caller_frame.lineno))))
+  if record_callers:
+    reference_callers[dap_req_block_key].append(make_reference((caller_frame.f_code.co_name,
+                                                                caller_frame.f_lineno)))
 
   # Every block has to have an error-free parse_tree
   if quarantine_manager.is_quarantined(dap_req_block_key):
     print(f'{institution} {requirement_id} Quarantined block (ignored)', file=log_file)
-    return
+    return []
   parse_tree = get_parse_tree(dap_req_block_key)
 
   if len(parse_tree) == 0:
     # Block not parsed yet.
     print(f'{institution} {requirement_id} Empty parse tree (ignored)', file=fail_file)
-    return
+    return []
 
-  if 'error' in parse_tree.keys():
+  if 'error' in parse_tree:
     # Should not occur
     print(f'{institution} {requirement_id} {parse_tree["error"]}', file=fail_file)
-    return
-
-  header_dict = traverse_header(institution, requirement_id, parse_tree)
+    return []
 
   # Characterize blocks as top-level or nested for reporting purposes; use capitalization to sort
   # top-level before nested.
@@ -575,8 +846,7 @@ def process_block(block_info: dict,
         class_credits, minres_list, mingrade_list, mingpa_list, maxtransfer_list, max_classes,
         max_credits, other
   """
-  catalog_years_str = catalog_years(block_info['period_start'],
-                                    block_info['period_stop']).text
+  catalog_years_str = catalog_years_text(block_info['period_start'], block_info['period_stop'])
 
   block_info_dict = {'institution': institution,
                      'requirement_id': requirement_id,
@@ -600,37 +870,34 @@ def process_block(block_info: dict,
                       'plan_cip_code': plan_dict['cip_code'],
                       'plan_active_terms': block_info['num_recent_active_terms'],
                       'plan_enrollment': block_info['recent_enrollment'],
-                      'subplans': [],
+                      'subplans': [{'subplan_block_info': subplan['requirement_block'],
+                                    'subplan_name': subplan['subplan'],
+                                    'subplan_type': subplan['type'],
+                                    'subplan_description': subplan['description'],
+                                    'subplan_effective_date': subplan['effective_date'],
+                                    'subplan_cip_code': subplan['cip_code'],
+                                    'subplan_active_terms':
+                                    subplan['requirement_block']['num_recent_active_terms'],
+                                    'subplan_enrollment':
+                                    subplan['requirement_block']['recent_enrollment'],
+                                    'subplan_reference_count': 0,
+                                    'subplan_others': []
+                                    } for subplan in plan_dict['subplans']],
                       'others': []
                       }
 
-    for subplan in plan_dict['subplans']:
-      subplan_block_info = subplan['requirement_block']
-      subplan_dict = {'subplan_block_info': subplan_block_info,
-                      'subplan_name': subplan['subplan'],
-                      'subplan_type': subplan['type'],
-                      'subplan_description': subplan['description'],
-                      'subplan_effective_date': subplan['effective_date'],
-                      'subplan_cip_code': subplan['cip_code'],
-                      'subplan_active_terms': subplan_block_info['num_recent_active_terms'],
-                      'subplan_enrollment': subplan_block_info['recent_enrollment'],
-                      'subplan_reference_count': 0,
-                      'subplan_others': []
-                      }
-      plan_info_dict['subplans'].append(subplan_dict)
-
     block_info_dict['plan_info'] = plan_info_dict
 
-    # Add the plan_info_dict to the programs table too, for generating the header-based catalog
-    # description of the program.
-    header_dict['other']['plan_info'] = plan_info_dict
+    # Index the plan’s subplans by their requirement_ids
+    subplan_indexes[dap_req_block_key] = {subplan['subplan_block_info']['requirement_id']: subplan
+                                          for subplan in plan_info_dict['subplans']}
 
   else:
     # For non-plan blocks, look up the subplan in the plan dict, if possible
-    subplan_list = context_list[0]['block_info']['plan_info']['subplans']
-    for subplan in subplan_list:
-      if (subplan['subplan_block_info']['requirement_id'] == requirement_id):
-        subplan['subplan_reference_count'] += 1
+    plan_block_info = context_list[0]['block_info'] if context_list else {}
+    if 'plan_info' in plan_block_info and \
+       (subplan := plan_subplan_index(plan_block_info).get(requirement_id)):
+      subplan['subplan_reference_count'] += 1
 
   #   # This could be a subplan block that wasn’t referenced from the plan block, in which case update
   #   # update the plan block’s subplans list
@@ -702,39 +969,50 @@ def process_block(block_info: dict,
     body_list = parse_tree['body_list']
   except KeyError:
     print(institution, requirement_id, 'Missing Body', file=fail_file)
-    return
+    return []
   if len(body_list) == 0:
     print(institution, requirement_id, 'Empty Body', file=log_file)
   else:
+    # Look up all the copy_rules targets in the block at once, the first time the block is seen.
+    if reference_counts[dap_req_block_key] == 1:
+      prefetch_copy_rules_targets(institution, copy_rules_refs(body_list))
+
+    # Extend the context_list in place for the traversal. A body item can add to the context (body
+    # remarks do), so trim it back after each item.
+    context_list.append({'block_info': block_info_dict})
+    item_context_len = len(context_list)
     for body_item in body_list:
-      # traverse_body(body_item, item_context)
-      traverse_body(body_item, context_list + [{'block_info': block_info_dict}])
-
-  # Enter the block’s header info into the programs table if it’s not already there
-  if dap_req_block_key not in program_blocks_list:
-    program_blocks_list.append(dap_req_block_key)
-    total_credits_col = json.dumps(header_dict["total_credits_list"], ensure_ascii=False)
-    maxtransfer_col = json.dumps(header_dict["maxtransfer_list"], ensure_ascii=False)
-    minres_col = json.dumps(header_dict["minres_list"], ensure_ascii=False)
-    mingrade_col = json.dumps(header_dict["mingrade_list"], ensure_ascii=False)
-    mingpa_col = json.dumps(header_dict["mingpa_list"], ensure_ascii=False)
-    other_col = json.dumps(header_dict['other'], ensure_ascii=False)
-
-    programs_writer.writerow([f'{institution[0:3]}',
-                              f'{requirement_id}',
-                              f'{block_info_dict["block_type"]}',
-                              f'{block_info_dict["block_value"]}',
-                              f'{block_info_dict["block_title"]}',
-                              total_credits_col,
-                              maxtransfer_col,
-                              minres_col,
-                              mingrade_col,
-                              mingpa_col,
-                              other_col,
-                              generated_date
-                              ])
+      traverse_body(body_item, context_list)
+      del context_list[item_context_len:]
+    context_list.pop()
+    # The block_info_dict's encoding is needed only while the block's body is being traversed
+    block_info_encodings.pop(id(block_info_dict), None)
+
+  # Enter the block’s header info into the programs table if it’s not already there. The header is
+  # traversed only then: the header_dict isn’t used for anything else.
+  if dap_req_block_key not in program_blocks:
+    program_blocks.add(dap_req_block_key)
+    header_dict = traverse_header(institution, requirement_id, parse_tree)
+    if plan_dict:
+      # Add the plan_info_dict to the programs table too, for generating the header-based catalog
+      # description of the program.
+      header_dict['other']['plan_info'] = block_info_dict['plan_info']
+    header_cols = [json_encode(header_dict[header_col]) for header_col in program_header_cols]
+
+    program_row = [institution[0:3],
+                   requirement_id,
+                   block_info_dict['block_type'],
+                   block_info_dict['block_value'],
+                   block_info_dict['block_title'],
+                   *header_cols,
+                   generated_date
+                   ]
+
+    program_rows.append(program_row)
+    flush_rows()
 
   # Finish handling academic plans
+  later_blocks = []
   if plan_dict:
     # Log information about subplan and others references
     if (num_subplans := len(plan_dict['subplans'])) > 0:
@@ -753,22 +1031,25 @@ def process_block(block_info: dict,
           print(f'{institution} {requirement_id} Subplan {subplan_name} referenced '
                 f'{num_references} times; {subplan_enrollment:,} enrolled', file=subplans_file)
 
-      # Now process any un-referenced subplans
+      # Un-referenced subplans get processed after this block
       for subplan_block_info in unreferenced_subplans:
-        process_block(subplan_block_info, [{'block_info': block_info_dict}])
+        later_blocks.append((subplan_block_info, [{'block_info': block_info_dict}], None))
 
     if (num_others := len(block_info_dict['plan_info']['others'])) > 0:
       s = '' if num_others == 1 else 's'
       print(f'{institution} {requirement_id} {num_others} Other block{s} referenced',
             file=subplans_file)
 
+  return later_blocks
+
 
 # traverse_header()
 # =================================================================================================
 def traverse_header(institution: str, requirement_id: str, parse_tree: dict) -> dict:
   """Extract program-wide qualifiers, and update block_info with the values found.
 
-  Handles only fields deemed relevant to transfer.
+  Handles only fields deemed relevant to transfer. Called just once per block, when the block is
+  entered into the programs table.
   """
   return_dict = dict()
   # Lists of limits that might or might not be specified in the header. Each is a list of dicts
@@ -779,11 +1060,12 @@ def traverse_header(institution: str, requirement_id: str, parse_tree: dict) ->
   #    Min Residency
   #    Min Grade
   #    Min GPA
-  for key in ['total_credits_list',
-              'maxtransfer_list',
-              'minres_list',
-              'mingrade_list',
-              'mingpa_list']:
+  column_lists = ['total_credits_list',
+                  'maxtransfer_list',
+                  'minres_list',
+                  'mingrade_list',
+                  'mingpa_list']
+  for key in column_lists:
     return_dict[key] = []
 
   # The ignomious 'other' column: a dict of lists of dicts
@@ -797,6 +1079,11 @@ def traverse_header(institution: str, requirement_id: str, parse_tree: dict) ->
                           'proxyadvice_list': [],
                           'conditional_dict': []}
 
+  # The lists that header_handlers results get appended to, whether columns or parts of Other
+  other_dict = return_dict['other']
+  header_lists = {which_list: return_dict[which_list] for which_list in column_lists}
+  header_lists.update(other_dict)
+
   try:
     if len(parse_tree['header_list']) == 0:
       print(f'{institution} {requirement_id} Empty Header', file=log_file)
@@ -806,141 +1093,72 @@ def traverse_header(institution: str, requirement_id: str, parse_tree: dict) ->
     parse_tree = exit(f'{institution} {requirement_id} Invalid parse_tree: {parse_tree}')
 
   for header_item in parse_tree['header_list']:
-
-    if not isinstance(header_item, dict):
-      exit(f'{institution} {requirement_id} Header “{header_item}” is not a dict')
-
+    # (get_parse_tree() has already checked that header items are dicts)
     for key, value in header_item.items():
-      match key:
 
-        case 'header_class_credit':
-          # ---------------------------------------------------------------------------------------
-
-          return_dict['total_credits_list'].append(header_classcredit(institution, requirement_id,
-                                                                      value, do_proxyadvice))
+      if key in header_handlers:
+        # -----------------------------------------------------------------------------------------
+        handler, which_list = header_handlers[key]
+        if log_header_items:
+          print(f'{institution} {requirement_id} Header {key[7:]}', file=log_file)
+        if handler is header_classcredit:
+          header_lists[which_list].append(handler(institution, requirement_id,
+                                                  value, do_proxyadvice))
+        else:
+          header_lists[which_list].append(handler(institution, requirement_id, value))
+
+      elif key in header_ignored_keys:
+        # -----------------------------------------------------------------------------------------
+        if log_header_items:
+          print(f'{institution} {requirement_id} Header {key} (ignored)', file=log_file)
 
-        case 'conditional':
-          # ---------------------------------------------------------------------------------------
-          """ Observed:
-                No course list items
-                 58   T: ['header_class_credit']
-                 30   F: ['header_class_credit']
-                 49   T: ['header_share']
-                 49   F: ['header_share']
-                  7   T: ['header_minres']
-
-                With course list items
-                The problem is that many of these expand to un-useful lists of courses, but others
-                are meaningful. Need to look at them in more detail.
-                 15   T: ['header_maxcredit']
-                  1   T: ['header_maxtransfer']
-                  2   T: ['header_minclass']
-                  5   T: ['header_mincredit']
-                  1   F: ['header_mincredit']
-
-                Recursive item
-                 28   F: ['conditional_dict']
-          """
+      elif key == 'conditional':
+        # -----------------------------------------------------------------------------------------
+        """ Observed:
+              No course list items
+               58   T: ['header_class_credit']
+               30   F: ['header_class_credit']
+               49   T: ['header_share']
+               49   F: ['header_share']
+                7   T: ['header_minres']
+
+              With course list items
+              The problem is that many of these expand to un-useful lists of courses, but others
+              are meaningful. Need to look at them in more detail.
+               15   T: ['header_maxcredit']
+                1   T: ['header_maxtransfer']
+                2   T: ['header_minclass']
+                5   T: ['header_mincredit']
+                1   F: ['header_mincredit']
+
+              Recursive item
+               28   F: ['conditional_dict']
+        """
+        if log_header_items:
           print(f'{institution} {requirement_id} Header conditional', file=log_file)
-          header_conditional(institution, requirement_id, return_dict, header_item)
-
-        case 'header_lastres':
-          # ---------------------------------------------------------------------------------------
-          # A subset of residency requirements
-          print(f'{institution} {requirement_id} Header lastres (ignored)', file=log_file)
-          pass
-
-        case 'header_maxclass':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header maxclass', file=log_file)
-          return_dict['other']['maxclass_list'].append(header_maxclass(institution, requirement_id,
-                                                                       value))
-
-        case 'header_maxcredit':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header maxcredit', file=log_file)
-          return_dict['other']['maxcredit_list'].append(header_maxcredit(institution,
-                                                                         requirement_id,
-                                                                         value))
+        header_conditional(institution, requirement_id, return_dict, header_item)
 
-        case 'header_maxpassfail':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header maxpassfail', file=log_file)
-          return_dict['other']['maxpassfail_list'].append(header_maxpassfail(institution,
-                                                                             requirement_id,
-                                                                             value))
-
-        case 'header_maxperdisc':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header maxperdisc', file=log_file)
-          return_dict['other']['maxperdisc_list'].append(header_maxperdisc(institution,
-                                                                           requirement_id, value))
-
-        case 'header_maxtransfer':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header maxtransfer', file=log_file)
-          return_dict['maxtransfer_list'].append(header_maxtransfer(institution, requirement_id,
-                                                                    value))
-
-        case 'header_minclass':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header minclass', file=log_file)
-          return_dict['other']['minclass_list'].append(header_minclass(institution,
-                                                                       requirement_id, value))
-
-        case 'header_mincredit':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header mincredit', file=log_file)
-          return_dict['other']['mincredit_list'].append(header_mincredit(institution,
-                                                                         requirement_id, value))
-
-        case 'header_mingpa':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header mingpa', file=log_file)
-          return_dict['mingpa_list'].append(header_mingpa(institution, requirement_id, value))
-
-        case 'header_mingrade':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header mingrade', file=log_file)
-          return_dict['mingrade_list'].append(header_mingrade(institution, requirement_id, value))
-
-        case 'header_minperdisc':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header minperdisc', file=log_file)
-          return_dict['other']['minperdisc_list'].append(header_minperdisc(institution,
-                                                                           requirement_id, value))
-
-        case 'header_minres':
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id} Header minres', file=log_file)
-          return_dict['minres_list'].append(header_minres(institution, requirement_id, value))
-
-        case 'proxy_advice':
-          # ---------------------------------------------------------------------------------------
-          if do_proxyadvice:
-            return_dict['other']['proxyadvice_list'].append(value)
+      elif key == 'proxy_advice':
+        # -----------------------------------------------------------------------------------------
+        if do_proxyadvice:
+          other_dict['proxyadvice_list'].append(value)
+          if log_header_items:
             print(f'{institution} {requirement_id} Header {key}', file=log_file)
-          else:
+        else:
+          if log_header_items:
             print(f'{institution} {requirement_id} Header {key} (ignored)', file=log_file)
 
-        case 'remark':
-          # ---------------------------------------------------------------------------------------
-          # (Not observed to occur)
+      elif key == 'remark':
+        # -----------------------------------------------------------------------------------------
+        # (Not observed to occur)
+        if log_header_items:
           print(f'{institution} {requirement_id} Header remark', file=log_file)
-          assert 'remark' not in return_dict['other'].keys()
-          return_dict['other']['remark'] = value
-
-        case 'header_maxterm' | 'header_minterm' | 'lastres' | 'noncourse' | 'optional' | \
-             'rule_complete' | 'standalone' | 'header_share' | 'header_tag' | 'under':
-          # ---------------------------------------------------------------------------------------
-          # Intentionally ignored: there are no course requirements or restrictions to report for
-          # these.
-          print(f'{institution} {requirement_id} Header {key} (ignored)', file=log_file)
-          pass
+        assert 'remark' not in other_dict
+        other_dict['remark'] = value
 
-        case _:
-          # ---------------------------------------------------------------------------------------
-          print(f'{institution} {requirement_id}: Unexpected {key} in header', file=sys.stderr)
+      else:
+        # -----------------------------------------------------------------------------------------
+        print(f'{institution} {requirement_id}: Unexpected {key} in header', file=sys.stderr)
 
   return return_dict
 
@@ -979,51 +1197,61 @@ def traverse_body(node: Any, context_list: list) -> None:
 
   global do_remarks, args
 
-  # Get the program block_type and block_value from the first element of the context_list
-  program_block_type = context_list[0]['block_info']['block_type']
+  # Handle lists before summarizing the context: list items get their own traversals
+  if isinstance(node, list):
+    for item in node:
+      traverse_body(item, context_list)
+    return
+
+  # Remarks suppressed from the command line need no further work
+  if not do_remarks and isinstance(node, dict) and isinstance(node.get('remark'), str):
+    return
+
+  # Get the program block_value from the first element of the context_list
   program_block_value = context_list[0]['block_info']['block_value']
-  nested_blocks = []
+
+  # The block_values and requirement_ids of the blocks in the context_list. (The block_values are
+  # used only for membership tests, so duplicates don’t matter.)
+  nested_block_values = []
+  nested_block_requirement_ids = []
   for context_item in context_list:
-    try:
-      nested_blocks.append(context_item['block_info'])
-    except KeyError:
-      pass
-  nested_block_values = [block_info['block_value'] for block_info in nested_blocks]
-  nested_block_requirement_ids = [block_info['requirement_id'] for block_info in nested_blocks]
-  # Eliminate duplicates while preserving order (does nothing!)
-  nested_block_values = list(dict.fromkeys(nested_block_values))
+    if (block_info := context_item.get('block_info')) is not None:
+      nested_block_values.append(block_info['block_value'])
+      nested_block_requirement_ids.append(block_info['requirement_id'])
+      containing_block_info = block_info
 
   # The path of requirement_ids to the current block
-  requirement_ids = ':'.join(list(dict.fromkeys(nested_block_requirement_ids)))
+  requirement_ids = ':'.join(dict.fromkeys(nested_block_requirement_ids))
 
   # The containing block’s context is the last block_info in the context list
-  block_info = nested_blocks[-1]
-  institution = block_info['institution']
-  requirement_id = block_info['requirement_id']
-  block_type = block_info['block_type']
-  block_value = block_info['block_value']
-  block_title = block_info['block_title']
-
-  # Handle lists
-  if isinstance(node, list):
-    for item in node:
-      traverse_body(item, context_list)
-
-  elif isinstance(node, dict):
+  institution = containing_block_info['institution']
+  requirement_id = containing_block_info['requirement_id']
+  block_type = containing_block_info['block_type']
+  block_value = containing_block_info['block_value']
+  block_title = containing_block_info['block_title']
+
+  # Requirements that only get logged write nothing but the containing block’s institution and
+  # requirement_id, so each is handled only the first time it is reached within a given block.
+  if isinstance(node, dict) and not node.keys().isdisjoint(log_only_requirements):
+    log_only_key = (id(node), institution, requirement_id)
+    if log_only_key in log_only_nodes:
+      return
+    log_only_nodes.add(log_only_key)
+
+  if isinstance(node, dict):
     # A dict should have one key that identifies the requirement type, and a sub-dict that gives the
     # details about that requirement, including the label that gives it its name.
     assert len(node) == 1, f'{list(node.keys())}'
-    requirement_type, requirement_value = list(node.items())[0]
+    requirement_type, requirement_value = next(iter(node.items()))
 
     # String values are remarks: add to context, and continue. Can be suppressed from command line.
+    # The context_list is extended in place so the remark applies to the requirements that follow
+    # it; whoever extended the context_list for this traversal trims it back afterwards.
     if isinstance(requirement_value, str):
-      assert requirement_type == 'remark'
-      if do_remarks:
-        print(f'{institution} {requirement_id} Body remark',
-              file=log_file)
-        context_list += [{requirement_type: requirement_value}]
-      else:
-        pass
+      assert requirement_type == 'remark' and do_remarks
+      print(f'{institution} {requirement_id} Body remark',
+            file=log_file)
+      context_list.append({requirement_type: requirement_value})
 
     # Lists happen in requirement_values because of how the grammar handles requirements that can
     # occur in different orders. (“This or that, zero or more times.”)
@@ -1033,10 +1261,9 @@ def traverse_body(node: Any, context_list: list) -> None:
 
     elif isinstance(requirement_value, dict):
       context_dict = get_restrictions(requirement_value)
-      try:
-        context_dict['requirement_name'] = requirement_value['label']
-        print(f'{institution} {requirement_id} {requirement_value["label"]}', file=label_file)
-      except KeyError:
+      if (label_str := log_label(institution, requirement_id, requirement_value)) is not None:
+        context_dict['requirement_name'] = label_str
+      else:
         # Unless a conditional, if there is no label, add a placeholder name, and log the situation
         if requirement_type != 'conditional':
           context_dict['requirement_name'] = 'Unnamed Requirement'
@@ -1059,52 +1286,40 @@ def traverse_body(node: Any, context_list: list) -> None:
                           requirement_value['block_type'],
                           requirement_value['block_value']]
 
-            if block_args[2].lower().startswith('mhc'):
+            if block_args[2][:3].lower() == 'mhc':
               # Ignore Honors College requirements
               pass
 
             else:
-              with psycopg.connect('dbname=cuny_curriculum') as conn:
-                with conn.cursor(row_factory=dict_row) as cursor:
-                  blocks = cursor.execute("""
-                  select institution, requirement_id, block_type, block_value, title as block_title,
-                         period_start, period_stop, major1
-                    from requirement_blocks
-                   where term_info is not null
-                     and institution = %s
-                     and block_type = %s
-                     and block_value = %s
-                  """, block_args)
-
-                  target_block = None
-
-                  if cursor.rowcount == 0:
-                    print(f'{institution} {requirement_id} Body block: no active {block_args[1:]} '
-                          f'blocks', file=fail_file)
-
-                  elif cursor.rowcount > 1:
-                    # Hopefully, the major1 field of exactly one block will match this program's
-                    # block value, resolving the issue.
-                    matching_rows = []
-                    for row in cursor:
-                      if row['major1'] in nested_block_values:
-                        matching_rows.append(row)
-
-                    if len(matching_rows) == 1:
-                      target_block = matching_rows[0]
-                    else:
-                      print(f'{institution} {requirement_id} Body block: {cursor.rowcount} active '
-                            f'{block_args[1:]} blocks; {len(matching_rows)} major1 = '
-                            f'{program_block_value} matches',
-                            file=fail_file)
-                  else:
-                    target_block = cursor.fetchone()
+              rows = lookup_blocks(*block_args)
+
+              target_block = None
+
+              if len(rows) == 0:
+                print(f'{institution} {requirement_id} Body block: no active {block_args[1:]} '
+                      f'blocks', file=fail_file)
+
+              elif len(rows) > 1:
+                # Hopefully, the major1 field of exactly one block will match this program's
+                # block value, resolving the issue.
+                matching_rows = [row for row in rows if row['major1'] in nested_block_values]
+
+                if len(matching_rows) == 1:
+                  target_block = matching_rows[0]
+                else:
+                  print(f'{institution} {requirement_id} Body block: {len(rows)} active '
+                        f'{block_args[1:]} blocks; {len(matching_rows)} major1 = '
+                        f'{program_block_value} matches',
+                        file=fail_file)
+              else:
+                target_block = rows[0]
 
-                  if target_block is not None:
-                    process_block(target_block, context_list + requirement_context)
-                    print(f'{institution} {requirement_id} Body block {target_block["block_type"]}'
-                          f' from {block_type}',
-                          file=log_file)
+              if target_block is not None:
+                with extended_context(context_list, requirement_context):
+                  process_block(target_block, context_list)
+                print(f'{institution} {requirement_id} Body block {target_block["block_type"]}'
+                      f' from {block_type}',
+                      file=log_file)
 
         case 'blocktype':
           # ---------------------------------------------------------------------------------------
@@ -1118,7 +1333,7 @@ def traverse_body(node: Any, context_list: list) -> None:
 
           # Is this a plan with active subplans?:
           try:
-            active_subplans = block_info['plan_info']['subplans']
+            active_subplans = containing_block_info['plan_info']['subplans']
           except KeyError as err:
             print(f'{institution} {requirement_id} Body blocktype: from {block_type} block',
                   file=fail_file)
@@ -1141,7 +1356,7 @@ def traverse_body(node: Any, context_list: list) -> None:
 
             # Does the context tell which concentration to process?
             condition_str = context_conditions(context_list)
-            eligible_concentrations = re.findall(r'CON == (\S+)', condition_str)
+            eligible_concentrations = concentration_re.findall(condition_str)
             if len(eligible_concentrations) > 1:
               print(f'{institution} {requirement_id} Body blocktype with multiple conditions',
                     file=log_file)
@@ -1160,8 +1375,8 @@ def traverse_body(node: Any, context_list: list) -> None:
             for active_subplan in active_subplans:
               if not eligible_concentrations or \
                  active_subplan['subplan_name'] in eligible_concentrations:
-                process_block(active_subplan['subplan_block_info'],
-                              context_list + requirement_context)
+                with extended_context(context_list, requirement_context):
+                  process_block(active_subplan['subplan_block_info'], context_list)
 
             print(f'{institution} {requirement_id} Block blocktype: {num_subplans_str}',
                   file=log_file)
@@ -1172,8 +1387,9 @@ def traverse_body(node: Any, context_list: list) -> None:
           # This is where course lists turn up, in general.
           try:
             if course_list := requirement_value['course_list']:
-              map_courses(institution, requirement_ids, block_title,
-                          context_list + requirement_context, requirement_value)
+              with extended_context(context_list, requirement_context):
+                map_courses(institution, requirement_ids, block_title,
+                            context_list, requirement_value)
           except KeyError:
             # Course List is an optional part of ClassCredit
             pass
@@ -1189,62 +1405,41 @@ def traverse_body(node: Any, context_list: list) -> None:
           # Get rules from target block, which must come from same institution
           target_requirement_id = requirement_value['requirement_id']
 
-          with psycopg.connect('dbname=cuny_curriculum') as conn:
-            with conn.cursor(row_factory=dict_row) as cursor:
-              cursor.execute("""
-              select institution, requirement_id, block_type, block_value, title as block_title,
-                     period_start, period_stop, parse_tree
-                from requirement_blocks
-               where institution = %s
-                 and requirement_id = %s
-                 and period_stop ~* '^9'
-              """, (institution, target_requirement_id))
-              if cursor.rowcount != 1:
-                print(f'{institution} {requirement_id} Body copy_rules: {target_requirement_id} not'
-                      f' current', file=fail_file)
+          row = copy_rules_target(institution, target_requirement_id)
+          if row is None:
+            print(f'{institution} {requirement_id} Body copy_rules: {target_requirement_id} not'
+                  f' current', file=fail_file)
 
+          else:
+            # There cannot be cross-institutional course requirements, so checking the
+            # requirement_ids of the copy_rules already in the context is safe.
+            is_circular = any(context_dict.get('requirement_id') == row['requirement_id']
+                              for context_dict in context_list)
+            if is_circular:
+              print(institution, requirement_id, 'Body circular copy_rules', file=fail_file)
+            else:
+              parse_tree = row['parse_tree']
+              if 'error' in parse_tree:
+                print(f'{institution} {requirement_id} Body copy_rules {parse_tree["error"]}',
+                      file=fail_file)
               else:
-                row = cursor.fetchone()
-
-                is_circular = False
-                for context_dict in context_list:
-                  try:
-                    # There cannot be cross-institutional course requirements, so this is safe
-                    if row['requirement_id'] == context_dict['requirement_id']:
-                      print(institution, requirement_id, 'Body circular copy_rules', file=fail_file)
-                      is_circular = True
-                  except KeyError:
-                    pass
-
-                if not is_circular:
-                  parse_tree = row['parse_tree']
-                  if parse_tree == '{}':
-                    # Not expecting to do this
-                    print(f'{row.institution} {row.requirement_id} Body copy_rules parse target: '
-                          f'{row.requirement_id}', file=log_file)
-                    parse_tree = parse_block(row['institution'], row['requirement_id'],
-                                             row['period_start'], row['period_stop'])
-                  if 'error' in parse_tree.keys():
-                    print(f'{institution} {requirement_id} Body copy_rules {parse_tree["error"]}',
-                          file=fail_file)
-                  else:
-                    try:
-                      body_list = parse_tree['body_list']
-                    except KeyError as err:
-                      exit(f'{institution} {requirement_id} Body copy_rules: no body_list '
-                           f'{row.requirement_id}')
-                    if len(body_list) == 0:
-                      print(f'{institution} {requirement_id} Body copy_rules: empty body_list',
-                            file=fail_file)
-                    else:
-                      local_dict = {'institution': institution,
-                                    'requirement_id': row['requirement_id'],
-                                    'requirement_name': row['block_title']}
-                      local_context = [local_dict]
-                      traverse_body(body_list,
-                                    context_list + requirement_context + local_context)
-
-                      print(institution, requirement_id, 'Body copy_rules', file=log_file)
+                try:
+                  body_list = parse_tree['body_list']
+                except KeyError as err:
+                  exit(f'{institution} {requirement_id} Body copy_rules: no body_list '
+                       f'{row["requirement_id"]}')
+                if len(body_list) == 0:
+                  print(f'{institution} {requirement_id} Body copy_rules: empty body_list',
+                        file=fail_file)
+                else:
+                  local_dict = {'institution': institution,
+                                'requirement_id': row['requirement_id'],
+                                'requirement_name': row['block_title']}
+                  local_context = [local_dict]
+                  with extended_context(context_list, requirement_context, local_context):
+                    traverse_body(body_list, context_list)
+
+                  print(institution, requirement_id, 'Body copy_rules', file=log_file)
 
         case 'course_list':
           # ---------------------------------------------------------------------------------------
@@ -1253,13 +1448,14 @@ def traverse_body(node: Any, context_list: list) -> None:
 
         case 'course_list_rule':
           # ---------------------------------------------------------------------------------------
-          if 'course_list' not in requirement_value.keys():
+          if 'course_list' not in requirement_value:
             # Can't have a Course List Rule w/o a course list
             print(f'{institution} {requirement_id} Body course_list_rule w/o a Course List',
                   file=fail_file)
           else:
-            map_courses(institution, requirement_ids, block_title,
-                        context_list + requirement_context, requirement_value)
+            with extended_context(context_list, requirement_context):
+              map_courses(institution, requirement_ids, block_title,
+                          context_list, requirement_value)
             print(institution, requirement_id, 'Body course_list_rule', file=log_file)
 
         case 'rule_complete':
@@ -1295,20 +1491,11 @@ def traverse_body(node: Any, context_list: list) -> None:
           # Replace common variants of the requirement_name with standard-format version
           description_str = format_group_description(num_groups, num_required)
 
-          ignore_words = number_names + ['and', 'area', 'areas', 'choose', 'following', 'from',
-                                         'group', 'groups', 'module', 'modules', 'of', 'option',
-                                         'options', 'or', 'select', 'selected', 'selct', 'slect',
-                                         'sequence', 'sequences', 'set', 'study', 'the']
           word_str = context_dict['requirement_name']
 
-          # Strip digits and punctuation and extract resulting words from description string
-          words = [word.lower() for word in
-                   re.sub(r'[\d,:]+', ' ', word_str).split()]
-          for ignore_word in ignore_words:
-            try:
-              del words[words.index(ignore_word)]
-            except ValueError:
-              pass
+          # Strip digits and punctuation and extract the not-to-ignore words from description string
+          words = [word for word in digits_punct_re.sub(' ', word_str).lower().split()
+                   if word not in group_ignore_words]
 
           # Are there any not-to-ignore words left?
           if words:
@@ -1318,6 +1505,12 @@ def traverse_body(node: Any, context_list: list) -> None:
             # No: Replace the Scribed name with our formatted one.
             context_dict['requirement_name'] = description_str
 
+          # Look up the blocks referenced by all the groups at once
+          prefetch_blocks([(institution, requirement['block']['block_type'],
+                            requirement['block']['block_value'])
+                           for group in group_list for requirement in group
+                           if 'block' in requirement], current_only=True)
+
           for group_num, group in enumerate(group_list):
             if (group_num + 1) < len(number_ordinals):
               group_num_str = (f'{number_ordinals[group_num + 1].title()} of {num_groups_str} '
@@ -1328,14 +1521,15 @@ def traverse_body(node: Any, context_list: list) -> None:
             group_context = [{'group_number': group_num + 1,
                               'group_number_str': group_num_str}]
 
+            # What the group’s requirements turned out to be, logged once for the whole group
+            group_counts = Counter()
             for requirement in group:
               for key, value in requirement.items():
                 match key:
 
                   case 'block':
                     # -----------------------------------------------------------------------------
-                    block_name = value['label']
-                    print(f'{institution} {requirement_id} {value["label"]}', file=label_file)
+                    log_label(institution, requirement_id, value)
                     block_num_required = int(value['number'])
                     if block_num_required > 1:
                       print(f'{institution} {requirement_id} Group block: {block_num_required=}',
@@ -1345,47 +1539,29 @@ def traverse_body(node: Any, context_list: list) -> None:
                     block_value = value['block_value']
                     block_institution = value['institution']
                     block_args = [block_institution, block_type, block_value]
-                    with psycopg.connect('dbname=cuny_curriculum') as conn:
-                      with conn.cursor(row_factory=dict_row) as cursor:
-                        cursor.execute("""
-                        select institution,
-                                    requirement_id,
-                                    block_type,
-                                    block_value,
-                                    title as block_title,
-                                    period_start, period_stop, major1
-                               from requirement_blocks
-                              where term_info is not null
-                                and institution = %s
-                                and block_type =  %s
-                                and block_value = %s
-                                and period_stop ~* '^9'
-                        """, [institution, block_type, block_value])
-
-                        target_block = None
-                        if cursor.rowcount == 0:
-                          print(f'{institution} {requirement_id} Group block: no active '
-                                f'{block_args[1:]} blocks', file=fail_file)
-                        elif cursor.rowcount > 1:
-                          # Hopefully, the major1 field of exactly one block will match this
-                          # program's block value, resolving the issue.
-                          matching_rows = []
-                          for row in cursor:
-                            if row['major1'] == block_value:
-                              matching_rows.append(row)
-                          if len(matching_rows) == 1:
-                            target_block = matching_rows[0]
-                          else:
-                            print(f'{institution} {requirement_id} Group block: {cursor.rowcount} '
-                                  f'active {block_args[1:]} blocks; {len(matching_rows)} major1 '
-                                  f'matches', file=fail_file)
-                        else:
-                          target_block = cursor.fetchone()
+                    rows = lookup_blocks(institution, block_type, block_value, current_only=True)
+
+                    target_block = None
+                    if len(rows) == 0:
+                      print(f'{institution} {requirement_id} Group block: no active '
+                            f'{block_args[1:]} blocks', file=fail_file)
+                    elif len(rows) > 1:
+                      # Hopefully, the major1 field of exactly one block will match this
+                      # program's block value, resolving the issue.
+                      matching_rows = [row for row in rows if row['major1'] == block_value]
+                      if len(matching_rows) == 1:
+                        target_block = matching_rows[0]
+                      else:
+                        print(f'{institution} {requirement_id} Group block: {len(rows)} '
+                              f'active {block_args[1:]} blocks; {len(matching_rows)} major1 '
+                              f'matches', file=fail_file)
+                    else:
+                      target_block = rows[0]
 
-                        if target_block is not None:
-                          process_block(target_block, context_list + requirement_context)
-                          print(f'{institution} {requirement_id} Group block '
-                                f'{target_block["block_type"]}', file=log_file)
+                    if target_block is not None:
+                      with extended_context(context_list, requirement_context):
+                        process_block(target_block, context_list)
+                      group_counts[f'block {target_block["block_type"]}'] += 1
 
                   case 'blocktype':
                     # -----------------------------------------------------------------------------
@@ -1395,39 +1571,39 @@ def traverse_body(node: Any, context_list: list) -> None:
                   case 'class_credit':
                     # -----------------------------------------------------------------------------
                     # This is where course lists turn up, in general.
-                    try:
-                      label_str = value['label']
-                      print(f'{institution} {requirement_id} {value["label"]}', file=label_file)
-                      map_courses(institution, requirement_ids, block_title,
-                                  context_list + requirement_context + group_context +
-                                  [{'requirement_name': label_str}], value)
-                    except KeyError as ke:
-                      # Course List is an optional part of ClassCredit
-                      pass
-                    print(institution, requirement_id, 'Group class_credit', file=log_file)
+                    if (label_str := log_label(institution, requirement_id, value)) is not None:
+                      try:
+                        with extended_context(context_list, requirement_context, group_context,
+                                              [{'requirement_name': label_str}]):
+                          map_courses(institution, requirement_ids, block_title,
+                                      context_list, value)
+                      except KeyError as ke:
+                        # Course List is an optional part of ClassCredit
+                        pass
+                    group_counts['class_credit'] += 1
 
                   case 'course_list_rule':
                     # -----------------------------------------------------------------------------
-                    if 'course_list' not in requirement_value.keys():
+                    if 'course_list' not in requirement_value:
                       # Can't have a Course List Rule w/o a course list
                       print(f'{institution} {requirement_id} Group course_list_rule w/o a Course '
                             f'List', file=fail_file)
                     else:
-                      map_courses(institution, requirement_ids, block_title,
-                                  context_list + group_context, value)
-                      print(institution, requirement_id, 'Group course_list_rule', file=log_file)
+                      with extended_context(context_list, group_context):
+                        map_courses(institution, requirement_ids, block_title,
+                                    context_list, value)
+                      group_counts['course_list_rule'] += 1
 
                   case 'group_requirement':
                     # -----------------------------------------------------------------------------
-                    print(institution, requirement_id, 'Body nested group_requirement',
-                          file=log_file)
+                    group_counts['nested group_requirement'] += 1
                     assert isinstance(value, dict)
-                    traverse_body(requirement, context_list + requirement_context + group_context)
+                    with extended_context(context_list, requirement_context, group_context):
+                      traverse_body(requirement, context_list)
 
                   case 'noncourse':
                     # -----------------------------------------------------------------------------
-                    print(f'{institution} {requirement_id} Group noncourse (ignored)',
-                          file=log_file)
+                    group_counts['noncourse (ignored)'] += 1
 
                   case 'rule_complete':
                     # -----------------------------------------------------------------------------
@@ -1438,6 +1614,11 @@ def traverse_body(node: Any, context_list: list) -> None:
                     # -----------------------------------------------------------------------------
                     exit(f'{institution} {requirement_id} Unexpected Group {key}')
 
+            if group_counts:
+              counts_str = ', '.join(f'{count} {item}' for item, count in group_counts.items())
+              print(f'{institution} {requirement_id} Group {group_num + 1}: {counts_str}',
+                    file=log_file)
+
           print(institution, requirement_id, 'Body group_requirement', file=log_file)
 
         case 'subset':
@@ -1448,10 +1629,9 @@ def traverse_body(node: Any, context_list: list) -> None:
           # Track MaxTransfer and MinGrade restrictions (qualifiers).
           context_dict = get_restrictions(requirement_value)
 
-          try:
-            context_dict['requirement_name'] = requirement_value['label']
-            print(f'{institution} {requirement_id} {requirement_value["label"]}', file=label_file)
-          except KeyError:
+          if (label_str := log_label(institution, requirement_id, requirement_value)) is not None:
+            context_dict['requirement_name'] = label_str
+          else:
             context_dict['requirement_name'] = 'No requirement name available'
             print(f'{institution} {requirement_id} Subset with no label', file=fail_file)
 
@@ -1475,11 +1655,22 @@ def traverse_body(node: Any, context_list: list) -> None:
           # The requirement_value should be a list of requirement_objects. The subset context
           # provides information for the whole subset; each requirement takes care of its own
           # context.
+          # Look up the blocks referenced by all the requirements at once
+          prefetch_blocks([(institution, requirement['block']['block_type'],
+                            requirement['block']['block_value'])
+                           for requirement in requirement_value['requirements']
+                           if 'block' in requirement])
+
           for requirement in requirement_value['requirements']:
-            assert len(requirement.keys()) == 1, f'{requirement.keys()}'
+            assert len(requirement) == 1, f'{requirement.keys()}'
 
             for key, rule in requirement.items():
 
+              if key in subset_ignored_keys:
+                # Ignored Qualifiers and rules
+                print(f'{institution} {requirement_id} Subset {key} (ignored)', file=log_file)
+                continue
+
               match key:
 
                 case 'block':
@@ -1490,51 +1681,37 @@ def traverse_body(node: Any, context_list: list) -> None:
                     print(f'{institution} {requirement_id} Subset block: {num_required=}',
                           file=fail_file)
                     continue
-                  block_label = rule['label']
-                  print(f'{institution} {requirement_id} {rule["label"]}', file=label_file)
+                  log_label(institution, requirement_id, rule)
                   required_block_type = rule['block_type']
                   required_block_value = rule['block_value']
                   block_args = [institution, required_block_type, required_block_value]
 
                   # CONC, MAJOR, and MINOR blocks must be active blocks; other (literally and
                   # figuratively) blocks need only be current.
-                  with psycopg.connect('dbname=cuny_curriculum') as conn:
-                    with conn.cursor(row_factory=dict_row) as cursor:
-
-                      cursor.execute("""
-                      select institution, requirement_id, block_type, block_value,
-                             title as block_title, period_start, period_stop, major1
-                        from requirement_blocks
-                       where term_info is not null
-                         and institution = %s
-                         and block_type = %s
-                         and block_value = %s
-                      """, block_args)
-
-                      target_block = None
-                      if cursor.rowcount == 0:
-                        print(f'{institution} {requirement_id} Subset block: no active '
-                              f'{block_args[1:]} blocks', file=fail_file)
-                      elif cursor.rowcount > 1:
-                        # Hopefully, the major1 field of exactly one block will match this
-                        # program's block value, resolving the issue.
-                        matching_rows = []
-                        for row in cursor:
-                          if row['major1'] == block_value:
-                            matching_rows.append(row)
-                        if len(matching_rows) == 1:
-                          target_block = matching_rows[0]
-                        else:
-                          print(f'{institution} {requirement_id} Subset block: {cursor.rowcount} '
-                                f'active {block_args[1:]} blocks; {len(matching_rows)} major1 '
-                                f'matches', file=fail_file)
-                      else:
-                        target_block = cursor.fetchone()
+                  rows = lookup_blocks(*block_args)
 
-                      if target_block is not None:
-                        process_block(target_block, context_list + requirement_context)
-                        print(f'{institution} {requirement_id} Subset block '
-                              f'{target_block["block_type"]} from {block_type}', file=log_file)
+                  target_block = None
+                  if len(rows) == 0:
+                    print(f'{institution} {requirement_id} Subset block: no active '
+                          f'{block_args[1:]} blocks', file=fail_file)
+                  elif len(rows) > 1:
+                    # Hopefully, the major1 field of exactly one block will match this
+                    # program's block value, resolving the issue.
+                    matching_rows = [row for row in rows if row['major1'] == block_value]
+                    if len(matching_rows) == 1:
+                      target_block = matching_rows[0]
+                    else:
+                      print(f'{institution} {requirement_id} Subset block: {len(rows)} '
+                            f'active {block_args[1:]} blocks; {len(matching_rows)} major1 '
+                            f'matches', file=fail_file)
+                  else:
+                    target_block = rows[0]
+
+                  if target_block is not None:
+                    with extended_context(context_list, requirement_context):
+                      process_block(target_block, context_list)
+                    print(f'{institution} {requirement_id} Subset block '
+                          f'{target_block["block_type"]} from {block_type}', file=log_file)
 
                 case 'blocktype':
                   # -------------------------------------------------------------------------------
@@ -1545,134 +1722,100 @@ def traverse_body(node: Any, context_list: list) -> None:
                 case 'conditional':
                   # -------------------------------------------------------------------------------
                   print(f'{institution} {requirement_id} Subset conditional', file=log_file)
-                  body_conditional(institution, requirement_id, context_list + subset_context, rule)
+                  with extended_context(context_list, subset_context):
+                    body_conditional(institution, requirement_id, context_list, rule)
 
                 case 'copy_rules':
                   # -------------------------------------------------------------------------------
                   # Get rules from target block, which must come from same institution
                   target_requirement_id = rule['requirement_id']
 
-                  with psycopg.connect('dbname=cuny_curriculum') as conn:
-                    with conn.cursor(row_factory=namedtuple_row) as cursor:
-                      cursor.execute("""
-                      select institution,
-                             requirement_id,
-                             block_type,
-                             block_value,
-                             title as block_title,
-                             period_start,
-                             period_stop,
-                             parse_tree
-                        from requirement_blocks
-                       where institution = %s
-                         and requirement_id = %s
-                         and period_stop ~* '^9'
-                      """, [institution, target_requirement_id])
-
-                      if cursor.rowcount != 1:
-                        print(f'{institution} {requirement_id} Subset copy_rules: '
-                              f'{target_requirement_id} not current',
-                              file=fail_file)
+                  row = copy_rules_target(institution, target_requirement_id)
+                  if row is None:
+                    print(f'{institution} {requirement_id} Subset copy_rules: '
+                          f'{target_requirement_id} not current',
+                          file=fail_file)
+                  else:
+                    # There are no cross-institutional course requirements, so checking the
+                    # requirement_ids of the blocks in the context is safe.
+                    is_circular = row['requirement_id'] in nested_block_requirement_ids
+                    if is_circular:
+                      print(institution, requirement_id, 'Subset circular copy_rules',
+                            file=fail_file)
+                    else:
+                      parse_tree = row['parse_tree']
+                      if 'error' in parse_tree:
+                        problem = parse_tree['error']
+                        print(f'{institution} {requirement_id} Subset copy_rules target '
+                              f'{row["requirement_id"]}: {problem}', file=fail_file)
                       else:
-                        row = cursor.fetchone()
-                        is_circular = False
-                        for context_dict in context_list:
-                          try:
-                            # There are no cross-institutional course requirements, so this is safe
-                            if row.requirement_id == context_dict['block_info']['requirement_id']:
-                              print(institution, requirement_id, 'Subset circular copy_rules',
-                                    file=fail_file)
-                              is_circular = True
-                          except KeyError as err:
-                            pass
-
-                        if not is_circular:
-                          parse_tree = row.parse_tree
-                          if parse_tree == '{}':
-                            print(f'{institution} {requirement_id} Subset copy_rules: parse '
-                                  f'{row.requirement_id}', file=log_file)
-                            parse_tree = parse_block(row.institution, row.requirement_id,
-                                                     row.period_start, row.period_stop)
-
-                          if 'error' in parse_tree.keys():
-                            problem = parse_tree['error']
-                            print(f'{institution} {requirement_id} Subset copy_rules target '
-                                  f'{row.requirement_id}: {problem}', file=fail_file)
-                          else:
-                            body_list = parse_tree['body_list']
-                            if len(body_list) == 0:
-                              print(f'{institution} {requirement_id} Subset copy_rules target '
-                                    f'{row.requirement_id}: empty body_list',
-                                    file=fail_file)
-                            else:
-                              local_dict = {'institution': institution,
-                                            'requirement_id': target_requirement_id,
-                                            'requirement_name': row.block_title}
-                              local_context = [local_dict]
-                              traverse_body(body_list,
-                                            context_list + requirement_context + local_context)
-
-                              print(institution, requirement_id, 'Subset copy_rules', file=log_file)
+                        body_list = parse_tree['body_list']
+                        if len(body_list) == 0:
+                          print(f'{institution} {requirement_id} Subset copy_rules target '
+                                f'{row["requirement_id"]}: empty body_list',
+                                file=fail_file)
+                        else:
+                          local_dict = {'institution': institution,
+                                        'requirement_id': target_requirement_id,
+                                        'requirement_name': row['block_title']}
+                          local_context = [local_dict]
+                          with extended_context(context_list, requirement_context, local_context):
+                            traverse_body(body_list, context_list)
+
+                          print(institution, requirement_id, 'Subset copy_rules', file=log_file)
 
                 case 'course_list_rule':
                   # -------------------------------------------------------------------------------
-                  if 'course_list' not in rule.keys():
+                  if 'course_list' not in rule:
                     # Can't have a Course List Rule w/o a course list
                     print(f'{institution} {requirement_id} Subset course_list_rule w/o a '
                           f'course_list', file=fail_file)
                   else:
-                    map_courses(institution, requirement_ids, block_title,
-                                context_list + requirement_context,
-                                rule)
+                    with extended_context(context_list, requirement_context):
+                      map_courses(institution, requirement_ids, block_title, context_list, rule)
                     print(f'{institution} {requirement_id} Subset course_list_rule', file=log_file)
 
                 case 'class_credit':
                   # -------------------------------------------------------------------------------
-                  if isinstance(rule, list):
-                    rule_dicts = rule
-                  else:
-                    rule_dicts = [rule]
-                  for rule_dict in rule_dicts:
-                    local_dict = get_restrictions(rule_dict)
-                    try:
-                      local_dict['requirement_name'] = rule_dict['label']
-                      print(f'{institution} {requirement_id} {rule_dict["label"]}', file=label_file)
-                    except KeyError as ke:
-                      print(f'{institution} {requirement_id} '
-                            f'Subset class_credit with no label', file=todo_file)
-                    # for k, v in rule_dict.items():
-
-                    #   if local_dict:
-                    #     local_context = [local_dict]
-                    #   else:
-                    #     local_context = []
-                    try:
-                      map_courses(institution, requirement_ids, block_title,
-                                  context_list + subset_context + [local_dict],
-                                  rule_dict)
-                    except KeyError as err:
-                      print(f'{institution} {requirement_id} {block_title} '
-                            f'KeyError ({err}) in subset class_credit', file=sys.stderr)
-                      exit(rule)
+                  rule_dicts = rule if isinstance(rule, list) else [rule]
+                  # The subset context is the same for all the rules; only the local_dict changes.
+                  with extended_context(context_list, subset_context):
+                    for rule_dict in rule_dicts:
+                      local_dict = get_restrictions(rule_dict)
+                      if (label_str := log_label(institution, requirement_id,
+                                                 rule_dict)) is not None:
+                        local_dict['requirement_name'] = label_str
+                      else:
+                        print(f'{institution} {requirement_id} '
+                              f'Subset class_credit with no label', file=todo_file)
+                      # for k, v in rule_dict.items():
+
+                      #   if local_dict:
+                      #     local_context = [local_dict]
+                      #   else:
+                      #     local_context = []
+                      try:
+                        with extended_context(context_list, [local_dict]):
+                          map_courses(institution, requirement_ids, block_title, context_list,
+                                      rule_dict)
+                      except KeyError as err:
+                        print(f'{institution} {requirement_id} {block_title} '
+                              f'KeyError ({err}) in subset class_credit', file=sys.stderr)
+                        exit(rule)
                   print(f'{institution} {requirement_id} Subset {key}', file=log_file)
 
                 case 'group_requirement':
                   # -------------------------------------------------------------------------------
-                  traverse_body(requirement, context_list + subset_context)
+                  with extended_context(context_list, subset_context):
+                    traverse_body(requirement, context_list)
                   print(f'{institution} {requirement_id} Subset group_requirement', file=log_file)
 
-                case 'maxpassfail' | 'maxperdisc' | 'mingpa' | 'minspread' | 'noncourse' | 'share':
-                  # -------------------------------------------------------------------------------
-                  # Ignored Qualifiers and rules
-                  print(f'{institution} {requirement_id} Subset {key} (ignored)', file=log_file)
-
                 case 'proxy_advice':
                   # -------------------------------------------------------------------------------
-                  # Validity check
-                  for context in subset_context:
-                    if 'proxy_advice' in context.keys():
-                      exit(f'{institution} {requirement_id} Subset context with repeated '
-                           f'proxy_advice')
+                  # Validity check: the subset context is just the subset's own context_dict
+                  if 'proxy_advice' in context_dict:
+                    exit(f'{institution} {requirement_id} Subset context with repeated '
+                         f'proxy_advice')
 
                   if do_proxyadvice:
                     subset_context[-1]['proxy_advice'] = rule
@@ -1736,16 +1879,27 @@ if __name__ == "__main__":
   parser.add_argument('--do_degrees', action='store_true')
   parser.add_argument('--no_proxy_advice', action='store_true')
   parser.add_argument('--no_remarks', action='store_true')
+  parser.add_argument('--no_header_log', action='store_true')
+  parser.add_argument('--copy_to_db', action='store_true')
+  parser.add_argument('-w', '--workers', type=int, default=1)
   parser.add_argument('--concise_conditionals', '-c', action='store_true')
   args = parser.parse_args()
 
   do_degrees = args.do_degrees
+  record_callers = args.debug
 
   do_proxyadvice = not args.no_proxy_advice
   do_remarks = not args.no_remarks
+  log_header_items = not args.no_header_log
+  conditional_markers = concise_markers if args.concise_conditionals else verbose_markers
 
   empty_tree = "'{}'"
 
+  if args.copy_to_db:
+    # Copy the output tables into the db as they are generated, in addition to writing the CSV files
+    db_conn = psycopg.connect('dbname=cuny_curriculum')
+    create_tables(db_conn)
+
   programs_writer.writerow(['Institution',
                             'Requirement ID',
                             'Type',
@@ -1777,9 +1931,10 @@ if __name__ == "__main__":
                        'With',
                        'Generate Date'])
 
-  block_types = defaultdict(int)
+  block_types = Counter()
   programs_count = 0
 
+  parallel_plans = []
   for acad_plan in active_plans():
     programs_count += 1
     requirement_block = acad_plan['requirement_block']
@@ -1789,11 +1944,30 @@ if __name__ == "__main__":
       print(f"{requirement_block['institution']} {requirement_block['requirement_id']} "
             f"{requirement_block['block_value']} with block type {requirement_block['block_type']}",
             file=anomaly_file)
-    process_block(requirement_block, context_list=[], plan_dict=acad_plan)
+    if args.workers > 1:
+      parallel_plans.append(acad_plan)
+    else:
+      process_block(requirement_block, context_list=[], plan_dict=acad_plan)
+
+  if parallel_plans:
+    # Nothing buffered here may be inherited by the (forked) worker processes
+    for open_file in [sys.stdout, programs_file, requirements_file, mapping_file] + report_files:
+      open_file.flush()
+    with ProcessPoolExecutor(args.workers, mp_context=get_context('fork'),
+                             initializer=init_worker) as executor:
+      for plan_rows in executor.map(map_plan, parallel_plans, chunksize=8):
+        add_plan_rows(*plan_rows)
+
+  flush_rows(force=True)
+  close_curriculum_db()
+  if db_conn is not None:
+    finish_tables(db_conn)
+    db_conn.commit()
+    db_conn.close()
 
   # Summary
   print(f'{programs_count:5,} Blocks')
-  for k, v in block_types.items():
+  for k, v in block_types.most_common():
     print(f'{v:5,} {k.title()}')
 
   print(f'\n{(datetime.datetime.now() - start_time).seconds} seconds')
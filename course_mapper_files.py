@@ -15,22 +15,30 @@ Data reports for T-Rex
   requirements_file   Spreadsheet of program requirement names
   mapping_file        Spreadsheet of course-to-requirements mappings
 """
+from course_mapper_paths import reports_dir
 from pathlib import Path
 
-home_dir = Path.home()
-anomaly_file = Path(home_dir, 'Projects/course_mapper/reports/anomalies.txt').open(mode='w')
-blocks_file = Path(home_dir, 'Projects/course_mapper/reports/blocks.txt').open(mode='w')
-conditions_file = Path(home_dir, 'Projects/course_mapper/reports/conditions.txt').open(mode='w')
-fail_file = Path(home_dir, 'Projects/course_mapper/reports/fail.txt').open(mode='w')
-label_file = Path(home_dir, 'Projects/course_mapper/reports/labels.txt').open(mode='w')
-log_file = Path(home_dir, 'Projects/course_mapper/reports/log.txt').open(mode='w')
-no_courses_file = Path(home_dir, 'Projects/course_mapper/reports/no_courses.txt').open(mode='w')
-subplans_file = Path(home_dir, 'Projects/course_mapper/reports/subplans.txt').open(mode='w')
-todo_file = Path(home_dir, 'Projects/course_mapper/reports/todo.txt').open(mode='w')
+# Buffer size for the (large) data report files
+csv_buffering = 1 << 20
+# Buffer size for the logging/development report files, which get written a line at a time; the
+# label and log files get written many times per requirement, so they get the big buffers too.
+report_buffering = 1 << 16
 
-programs_file = Path(home_dir, 'Projects/course_mapper/reports/dgw_programs.csv')\
-    .open(mode='w', newline='')
-requirements_file = Path(home_dir, 'Projects/course_mapper/reports/dgw_requirements.csv')\
-    .open(mode='w', newline='')
-mapping_file = Path(home_dir, 'Projects/course_mapper/reports/dgw_courses.csv')\
-    .open(mode='w', newline='')
+anomaly_file = Path(reports_dir, 'anomalies.txt').open(mode='w', buffering=report_buffering)
+blocks_file = Path(reports_dir, 'blocks.txt').open(mode='w', buffering=report_buffering)
+conditions_file = Path(reports_dir, 'conditions.txt').open(mode='w', buffering=report_buffering)
+fail_file = Path(reports_dir, 'fail.txt').open(mode='w', buffering=report_buffering)
+label_file = Path(reports_dir, 'labels.txt').open(mode='w', buffering=csv_buffering)
+log_file = Path(reports_dir, 'log.txt').open(mode='w', buffering=csv_buffering)
+no_courses_file = Path(reports_dir, 'no_courses.txt').open(mode='w', buffering=report_buffering)
+subplans_file = Path(reports_dir, 'subplans.txt').open(mode='w', buffering=report_buffering)
+todo_file = Path(reports_dir, 'todo.txt').open(mode='w', buffering=report_buffering)
+report_files = [anomaly_file, blocks_file, conditions_file, fail_file, label_file, log_file,
+                no_courses_file, subplans_file, todo_file]
+
+programs_file = Path(reports_dir, 'dgw_programs.csv')\
+    .open(mode='w', newline='', buffering=csv_buffering)
+requirements_file = Path(reports_dir, 'dgw_requirements.csv')\
+    .open(mode='w', newline='', buffering=csv_buffering)
+mapping_file = Path(reports_dir, 'dgw_courses.csv')\
+    .open(mode='w', newline='', buffering=csv_buffering)
@@ -0,0 +1,9 @@
+#! /usr/local/bin/python3
+"""Where the course mapper's report files go.
+
+Kept apart from course_mapper_files, which (re-)creates the report files when it is imported, so
+that programs that only read the reports, like load_mapping_tables, can find them too.
+"""
+from pathlib import Path
+
+reports_dir = Path(Path.home(), 'Projects/course_mapper/reports')
@@ -5,12 +5,30 @@ import psycopg
 import re
 import sys
 
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from coursescache import courses_cache
 from course_mapper_files import log_file, todo_file
-from psycopg.rows import namedtuple_row
+from dgw_parser import parse_block
+from functools import partial
 
-_parse_trees_cache = defaultdict(dict)
+# Connection to the curriculum db, shared by all lookups: see curriculum_db()
+_curriculum_conn = None
+
+# Parse trees, keyed by (institution, requirement_id)
+_parse_trees_cache = dict()
+
+# Mogrified course lists, keyed by institution, requirement_id, and the scribed and except courses.
+_mogrified_cache = dict()
+_mogrified_cache_size = 50000
+
+# Group descriptions, keyed by (num_groups, num_required): see format_group_description()
+_group_descriptions = dict()
+
+# Mogrified expressions, keyed by (expression, de_morgan): see mogrify_expression()
+_mogrified_expressions = dict()
+
+# Letter grades, keyed by grade_point: see letter_grade()
+_letter_grades = dict()
 
 notyet_dict = {'not-yet': True}
 
@@ -19,6 +37,22 @@ number_names = ['none', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', '
 number_ordinals = ['zeroth', 'first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh',
                    'eighth', 'ninth', 'tenth', 'eleventh', 'twelfth']
 
+# Program types, by the lowercase prefix used to recognize them: see plan_or_subplan()
+program_type_abbreviations = {'maj': 'MAJ', 'min': 'MIN', 'con': 'CON'}
+
+# Patterns used by mogrify_expression()
+plan_types_re = re.compile(r'major |conc |minor', re.I)
+and_re = re.compile(r' AND ', re.I)
+or_re = re.compile(r' OR ', re.I)
+not_re = re.compile(r' NOT ', re.I)
+
+# What mogrify_expression() turns tokens into; other tokens (values and parens) are kept as is.
+expression_symbols = {'MAJOR': 'MAJ', 'MINOR': 'MIN', 'CONC': 'CON',
+                      '&': ' && ', '|': ' || ', '=': ' == ', '^': ' != '}
+# ... and the same, inverted by de Morgan's theorem
+de_morgan_symbols = {'MAJOR': 'MAJ', 'MINOR': 'MIN', 'CONC': 'CON',
+                     '&': ' || ', '|': ' && ', '=': ' != ', '^': ' == '}
+
 MogrifiedInfo = namedtuple('MogrifiedInfo', 'course_id_str course_str credits career with_clause')
 
 
@@ -29,26 +63,58 @@ def called_from(depth=3, out_file=sys.stdout):
   if depth < 0:
     depth = 999
 
-  caller_frames = extract_stack()
+  # Walk back from the caller just as far as needed; the outermost frame gets printed first.
+  caller_frames = []
+  frame = sys._getframe(1)
+  while frame is not None and len(caller_frames) <= depth:
+    caller_frames.append(frame)
+    frame = frame.f_back
 
-  for index in range(-2 - depth, -1):
-    try:
-      function_name = f'{caller_frames[index].name}()'
-      file_name = caller_frames[index].filename
-      file_name = file_name[file_name.rindex('/') + 1:]
-      print(f'Frame: {function_name:20} at {file_name} '
-            f'line {caller_frames[index].lineno}', file=out_file)
-    except IndexError:
-      # Dont kvetch if stack isn’t deep enough
-      pass
+  for frame in reversed(caller_frames):
+    function_name = f'{frame.f_code.co_name}()'
+    file_name = frame.f_code.co_filename.rpartition('/')[2]
+    print(f'Frame: {function_name:20} at {file_name} line {frame.f_lineno}', file=out_file)
+
+
+# close_curriculum_db()
+# -------------------------------------------------------------------------------------------------
+def close_curriculum_db():
+  """Close the connection to the cuny_curriculum db, if it was ever opened."""
+  global _curriculum_conn
+  if _curriculum_conn is not None:
+    _curriculum_conn.close()
+    _curriculum_conn = None
+
+
+# curriculum_db()
+# -------------------------------------------------------------------------------------------------
+def curriculum_db(reconnect: bool = False) -> psycopg.Connection:
+  """Return the connection to the cuny_curriculum db, connecting the first time it is needed.
+
+  The connection is in autocommit mode, so lookups don’t leave a transaction open between them. A
+  forked worker process has to reconnect rather than share its parent’s connection.
+  """
+  global _curriculum_conn
+  if _curriculum_conn is None or reconnect:
+    _curriculum_conn = psycopg.connect('dbname=cuny_curriculum', autocommit=True)
+  return _curriculum_conn
 
 
 # format_group_description()
 # -------------------------------------------------------------------------------------------------
 def format_group_description(num_groups: int, num_required: int):
-  """Return an English string to replace the label (requirement_name) for group requirements."""
+  """Return an English string to replace the label (requirement_name) for group requirements.
+
+  The same few group sizes recur throughout a run, so each description is formatted just once.
+  """
   assert isinstance(num_groups, int) and isinstance(num_required, int), 'Precondition failed'
 
+  description_key = (num_groups, num_required)
+  try:
+    return _group_descriptions[description_key]
+  except KeyError:
+    pass
+
   suffix = '' if num_required == 1 else 's'
   if num_required < len(number_names):
     num_required_str = number_names[num_required].lower()
@@ -73,7 +139,10 @@ def format_group_description(num_groups: int, num_required: int):
     prefix = 'Either of the'
   else:
     prefix = f'Any {num_required_str} of the'
-  return f'{prefix} following {num_groups_str} group{s}'
+  description_str = f'{prefix} following {num_groups_str} group{s}'
+  _group_descriptions[description_key] = description_str
+
+  return description_str
 
 
 # get_parse_tree()
@@ -81,26 +150,35 @@ def format_group_description(num_groups: int, num_required: int):
 def get_parse_tree(dap_req_block_key: tuple) -> dict:
   """Look up the parse tree for a dap_req_block.
 
-  Cache it, and return it.
+  Parse trees don’t change during a run, so each block’s is looked up just once and cached.
   """
-  if dap_req_block_key not in _parse_trees_cache.keys():
-    with psycopg.connect('dbname=cuny_curriculum') as conn:
-      with conn.cursor(row_factory=namedtuple_row) as cursor:
-        cursor.execute("""
-        select period_start, period_stop, parse_tree
-          from requirement_blocks
-         where institution ~* %s
-           and requirement_id = %s
-        """, dap_req_block_key)
-        assert cursor.rowcount == 1
-        parse_tree = cursor.fetchone().parse_tree
-        if parse_tree is None:
-          institution, requirement_id = dap_req_block_key
-          parse_tree = parse_block(institution, requirement_id, row.period_start, row.period_stop)
-          print(f'{institution} {requirement_id} Reference to un-parsed block', file=log_file)
-    _parse_trees_cache[dap_req_block_key] = parse_tree
-
-  return _parse_trees_cache[dap_req_block_key]
+  try:
+    return _parse_trees_cache[dap_req_block_key]
+  except KeyError:
+    pass
+
+  with curriculum_db().cursor() as cursor:
+    cursor.execute("""
+    select period_start, period_stop, parse_tree
+      from requirement_blocks
+     where institution ~* %s
+       and requirement_id = %s
+    """, dap_req_block_key, prepare=True)
+    assert cursor.rowcount == 1
+    period_start, period_stop, parse_tree = cursor.fetchone()
+    if parse_tree is None:
+      institution, requirement_id = dap_req_block_key
+      parse_tree = parse_block(institution, requirement_id, period_start, period_stop)
+      print(f'{institution} {requirement_id} Reference to un-parsed block', file=log_file)
+
+  # Validate the header list once here rather than for each header item when it is traversed
+  for header_item in parse_tree.get('header_list', []):
+    if not isinstance(header_item, dict):
+      institution, requirement_id = dap_req_block_key
+      exit(f'{institution} {requirement_id} Header “{header_item}” is not a dict')
+  _parse_trees_cache[dap_req_block_key] = parse_tree
+
+  return parse_tree
 
 
 # get_restrictions()
@@ -152,14 +230,24 @@ def letter_grade(grade_point: float) -> str:
     1.3    D+
     1.0    D
     0.7    D- => "Any"
+
+  Only a few distinct grade_points get scribed, so each one is converted just once.
   """
+  try:
+    return _letter_grades[grade_point]
+  except KeyError:
+    pass
+
   if grade_point < 1.0:
-    return 'Any'
+    grade_str = 'Any'
   else:
     letter_index, suffix_index = divmod((10 * grade_point) - 7, 10)
-  letter = ['D', 'C', 'B', 'A'][min(int(letter_index), 3)]
-  suffix = ['-', '', '+'][min(int(suffix_index / 3), 2)]
-  return letter + suffix
+    letter = ['D', 'C', 'B', 'A'][min(int(letter_index), 3)]
+    suffix = ['-', '', '+'][min(int(suffix_index / 3), 2)]
+    grade_str = letter + suffix
+  _letter_grades[grade_point] = grade_str
+
+  return grade_str
 
 
 # Header Constructs
@@ -181,14 +269,9 @@ def header_classcredit(institution: str, requirement_id: str,
   if label_str := value['label']:
     return_dict['label'] = label_str
 
-  try:
-    # There might or might-not be proxy-advice
-    proxy_advice = value['proxy_advice']
-    if do_proxyadvice:
-      return_dict['proxy_advice'] = value['proxy_advice']
-  except KeyError:
-    # No proxy-advice (normal))
-    pass
+  # There might or might-not be proxy-advice (normally not), and it might not be wanted anyway
+  if do_proxyadvice and 'proxy_advice' in value:
+    return_dict['proxy_advice'] = value['proxy_advice']
 
   return_dict['is_pseudo'] = value['is_pseudo']
 
@@ -231,9 +314,9 @@ def header_maxtransfer(institution: str, requirement_id: str, value: dict) -> di
   """Process max-transfer restrictions in header sections."""
   mt_dict = {'label': value['label']}
 
-  number = float(value['maxtransfer']['number'])
-  class_or_credit = value['maxtransfer']['class_or_credit']
-  if class_or_credit == 'credit':
+  maxtransfer_dict = value['maxtransfer']
+  number = float(maxtransfer_dict['number'])
+  if maxtransfer_dict['class_or_credit'] == 'credit':
     mt_dict['limit'] = f'{number:3.1f} credits'
   else:
     suffix = '' if int(number) == 1 else 'es'
@@ -254,13 +337,12 @@ def header_minres(institution: str, requirement_id: str, value: dict) -> dict:
   Returns a dict with the number of classes or credits (it's always credits, in practice) plus
   the label if there is one.
   """
-  min_classes = value['minres']['min_classes']
-  min_credits = value['minres']['min_credits']
+  minres_dict = value['minres']
   # There must be a better way to do an xor check ...
-  match (min_classes, min_credits):
-    case [classes, None]:
+  match (minres_dict['min_classes'], minres_dict['min_credits']):
+    case (classes, None):
       minres_str = f'{int(classes)} classes'
-    case [None, credits]:
+    case (None, credits):
       minres_str = f'{float(credits):.1f} credits'
     case _:
       exit(f'{institution} {requirement_id} Invalid minres {value}')
@@ -270,22 +352,12 @@ def header_minres(institution: str, requirement_id: str, value: dict) -> dict:
   return {'minres': minres_str, 'label': label_str}
 
 
-# header_mingpa()
-# -------------------------------------------------------------------------------------------------
-def header_mingpa(institution: str, requirement_id: str, value: dict) -> dict:
-  """Process min-gpa restrictions in header sections."""
-  mingpa_dict = value['mingpa']
-  mingpa_dict['label'] = value['label']
-
-  return mingpa_dict
-
-
 # header_mingrade()
 # -------------------------------------------------------------------------------------------------
 def header_mingrade(institution: str, requirement_id: str, value: dict) -> dict:
   """Process min-grade restrictions in header sections."""
   mingrade_dict = value['mingrade']
-  mingrade_dict['letter_grade'] = letter_grade(float(value['mingrade']['number']))
+  mingrade_dict['letter_grade'] = letter_grade(float(mingrade_dict['number']))
   mingrade_dict['label'] = value['label']
 
   return mingrade_dict
@@ -295,15 +367,12 @@ def header_mingrade(institution: str, requirement_id: str, value: dict) -> dict:
 # -------------------------------------------------------------------------------------------------
 def header_maxclass(institution: str, requirement_id: str, value: dict) -> dict:
   """Process max-class restrictions in header sections."""
-  try:
-    for cruft_key in ['institution', 'requirement_id']:
-      del (value['maxclass']['course_list'][cruft_key])
-  except KeyError:
-    # The same block might have been mapped in a different context already
-    pass
+  course_list = value['maxclass']['course_list']
+  # The same block might have been mapped in a different context already
+  course_list.pop('institution', None)
+  course_list.pop('requirement_id', None)
 
   number = int(value['maxclass']['number'])
-  course_list = value['maxclass']['course_list']
   course_list['courses'] = [{'course_id': course_info.course_id_str,
                              'course': course_info.course_str,
                              'with': course_info.with_clause}
@@ -322,14 +391,11 @@ def header_maxclass(institution: str, requirement_id: str, value: dict) -> dict:
 # -------------------------------------------------------------------------------------------------
 def header_maxcredit(institution: str, requirement_id: str, value: dict) -> dict:
   """Process max-credit restrictions in header sections."""
-  try:
-    for cruft_key in ['institution', 'requirement_id']:
-      del (value['maxcredit']['course_list'][cruft_key])
-  except KeyError:
-    pass
+  course_list = value['maxcredit']['course_list']
+  course_list.pop('institution', None)
+  course_list.pop('requirement_id', None)
 
   number = float(value['maxcredit']['number'])
-  course_list = value['maxcredit']['course_list']
   course_list['courses'] = [{'course_id': course_info.course_id_str,
                              'course': course_info.course_str,
                              'with': course_info.with_clause}
@@ -345,54 +411,24 @@ def header_maxcredit(institution: str, requirement_id: str, value: dict) -> dict
   return maxcredit_dict
 
 
-# header_maxpassfail()
-# -------------------------------------------------------------------------------------------------
-def header_maxpassfail(institution: str, requirement_id: str, value: dict) -> dict:
-  """Process max pass-fail restrictions in header sections."""
-  maxpassfail_dict = value['maxpassfail']
-  maxpassfail_dict['label'] = value['label']
-
-  return maxpassfail_dict
-
-
-# header_maxperdisc()
-# -------------------------------------------------------------------------------------------------
-def header_maxperdisc(institution: str, requirement_id: str, value: dict) -> dict:
-  """Process max per-discipline restrictions in header sections."""
-  maxperdisc_dict = value['maxperdisc']
-  maxperdisc_dict['label'] = value['label']
-
-  return maxperdisc_dict
-
-
-# header_minclass()
-# -------------------------------------------------------------------------------------------------
-def header_minclass(institution: str, requirement_id: str, value: dict) -> dict:
-  """Process min classes restrictions in header sections."""
-  minclass_dict = value['minclass']
-  minclass_dict['label'] = value['label']
-
-  return minclass_dict
-
-
-# header_mincredit()
+# header_restriction()
 # -------------------------------------------------------------------------------------------------
-def header_mincredit(institution: str, requirement_id: str, value: dict) -> dict:
-  """Process min credits restrictions in header sections."""
-  mincredit_dict = value['mincredit']
-  mincredit_dict['label'] = value['label']
+def header_restriction(institution: str, requirement_id: str, value: dict,
+                       restriction_key: str) -> dict:
+  """Process header restrictions that are used as scribed, with just the label attached."""
+  restriction_dict = value[restriction_key]
+  restriction_dict['label'] = value['label']
 
-  return mincredit_dict
+  return restriction_dict
 
 
-# header_minperdisc()
-# -------------------------------------------------------------------------------------------------
-def header_minperdisc(institution: str, requirement_id: str, value: dict) -> dict:
-  """Process min per-discipline restrictions in header sections."""
-  minperdisc_dict = value['minperdisc']
-  minperdisc_dict['label'] = value['label']
-
-  return minperdisc_dict
+# The header restrictions that header_restriction() handles
+header_maxpassfail = partial(header_restriction, restriction_key='maxpassfail')
+header_maxperdisc = partial(header_restriction, restriction_key='maxperdisc')
+header_minclass = partial(header_restriction, restriction_key='minclass')
+header_mincredit = partial(header_restriction, restriction_key='mincredit')
+header_mingpa = partial(header_restriction, restriction_key='mingpa')
+header_minperdisc = partial(header_restriction, restriction_key='minperdisc')
 
 
 # header_proxyadvice()
@@ -517,43 +553,53 @@ def mogrify_course_list(institution: str, requirement_id: str, course_dict: dict
   # There has to be a course_dict to mogrify
   assert course_dict, 'Empty course_dict in mogrify_course_dict'
 
+  # The same course lists get scribed repeatedly: reuse the result if this one has been seen before.
+  cache_key = (institution, requirement_id,
+               tuple(tuple(tuple(course) for course in area)
+                     for area in course_dict['scribed_courses']),
+               tuple(tuple(course) for course in course_dict['except_courses']))
+  try:
+    return _mogrified_cache[cache_key]
+  except KeyError:
+    pass
+
   # Log non-empty include lists
   if course_dict['include_courses']:
     print(f'{institution} {requirement_id} Non-empty include_courses (ignored)', file=log_file)
 
   # Get the scribed list, which is divided into areas even if there are nont, and flatten it.
   course_list = course_dict['scribed_courses']
-  # Course tuples are (0: discipline, 1: catalog_number, 2: with_clause)
-  course_tuples = [tuple(course) for area in course_list for course in area]
-  # Get rid of redundant scribes
-  course_tuples_set = set([course_tuple for course_tuple in course_tuples])
+  # Course tuples are (0: discipline, 1: catalog_number, 2: with_clause); the set gets rid of
+  # redundant scribes.
+  course_tuples_set = {tuple(course) for area in course_list for course in area}
 
   # Create a set of active courses and a dict of corresponding with-clauses
   course_info_set = set()
   with_clauses = dict()
   for course_tuple in course_tuples_set:
+    # Courses with DWTerm or attribute with-clauses are dropped; other with-clauses go with each
+    # course the scribed course expands to.
+    with_clause = course_tuple[2].lower() if course_tuple[2] else ''
+    if 'dwterm' in with_clause or 'attribute' in with_clause:
+      continue
     course_infos = courses_cache(institution, course_tuple[0], course_tuple[1])
-    for course_info in course_infos:
-      if course_tuple[2]:
-        with_clause = course_tuple[2].lower()
-        if 'dwterm' in with_clause or 'attribute' in with_clause:
-          continue
+    course_info_set.update(course_infos)
+    if with_clause:
+      for course_info in course_infos:
         with_key = (course_info.course_id, course_info.offer_nbr)
-        if with_key in with_clauses.keys() and with_clauses[with_key] != course_tuple[2].lower():
+        previous_clause = with_clauses.get(with_key)
+        if previous_clause is not None and previous_clause != with_clause:
           print(f'{institution} {requirement_id} Mogrify: multiple with-clauses. '
-                f'{with_clauses[with_key]} != {course_tuple[2].lower()}',
-                file=debug_file)
-        with_clauses[with_key] = course_tuple[2].lower()
-      course_info_set.add(course_info)
+                f'{previous_clause} != {with_clause}',
+                file=log_file)
+        with_clauses[with_key] = with_clause
 
   # Create set of exclude courses (there is no areas structure in exclude lists)
   exclude_list = course_dict['except_courses']
-  exclude_tuples_set = set([tuple(course) for course in exclude_list])
+  exclude_tuples_set = {tuple(course) for course in exclude_list}
   exclude_info_set = set()
   for exclude_tuple in exclude_tuples_set:
-    course_infos = courses_cache(institution, exclude_tuple[0], exclude_tuple[1])
-    for course_info in course_infos:
-      exclude_info_set.add(course_info)
+    exclude_info_set.update(courses_cache(institution, exclude_tuple[0], exclude_tuple[1]))
 
   if len(exclude_info_set):
     print(f'{institution} {requirement_id} Non-empty exclude list', file=log_file)
@@ -578,18 +624,22 @@ def mogrify_course_list(institution: str, requirement_id: str, course_dict: dict
   # Remove excluded courses from the courses
   course_info_set -= exclude_info_set
 
-  return_list = []
-  for course in course_info_set:
-    with_key = (course_info.course_id, course_info.offer_nbr)
-    with_clause = with_clauses[with_key] if with_key in with_clauses.keys() else ''
-    # MogrifiedInfo = namedtuple('MogrifiedInfo', 'course_id_str course_str career with_clause')
-    mogrified_info = MogrifiedInfo._make([f'{course.course_id:06}:{course.offer_nbr}',
-                                          f'{course.discipline} {course.catalog_number}: '
-                                          f'{course.course_title}',
-                                          course.credits,
-                                          course.career,
-                                          with_clause])
-    return_list.append(mogrified_info)
+  # CourseTuple: course_id offer_nbr discipline catalog_number course_title credits designation
+  #              career
+  # MogrifiedInfo: course_id_str course_str credits career with_clause
+  return_list = [MogrifiedInfo(f'{str(course_id).zfill(6)}:{offer_nbr}',
+                               f'{discipline} {catalog_number}: {course_title}',
+                               credits,
+                               career,
+                               with_clauses.get((course_id, offer_nbr), ''))
+                 for (course_id, offer_nbr, discipline, catalog_number, course_title, credits, _,
+                      career) in course_info_set]
+
+  if len(_mogrified_cache) >= _mogrified_cache_size:
+    # Evict the oldest entry
+    del _mogrified_cache[next(iter(_mogrified_cache))]
+  _mogrified_cache[cache_key] = return_list
+
   return return_list
 
 
@@ -620,13 +670,9 @@ def plan_or_subplan(program_types: list, context_list: list) -> tuple:
 
   """
   for index, program_type in enumerate(program_types):
-    if program_type.lower().startswith('maj'):
-      program_types[index] = 'MAJ'
-    elif program_types.lower().startswith('min'):
-      program_types[index] = 'MIN'
-    elif program_types.lower().startswith('con'):
-      program_types[index] = 'CON'
-    else:
+    try:
+      program_types[index] = program_type_abbreviations[program_type[:3].lower()]
+    except KeyError:
       raise ValueError(f'{program_type} is not a valid program type')
 
   full_expression = context_conditions(context_list)
@@ -735,47 +781,39 @@ def mogrify_expression(expression: str, de_morgan: bool = False) -> str:
   The only relational operators that will occur are = and <>
 
   If de_morgan, invert the logic by de Morgan's theorem. (Used in an 'else' context)
+
+  The same conditions are in the context of every requirement they enclose, so each one is
+  mogrified just once.
   """
+  expression_key = (expression, de_morgan)
+  try:
+    return _mogrified_expressions[expression_key]
+  except KeyError:
+    pass
+
   sentence = ''
 
   # Is there anything to do?
-  if re.search('major |conc |minor', expression, flags=re.I):
+  if plan_types_re.search(expression):
     # Replace logical and relational operators with 1-character symbols.
     # relop = is already one char; <> is awkward: I chose to use ^
     working_expression = expression.strip()
-    working_expression = re.sub(' AND ', ' & ', working_expression, flags=re.I)
-    working_expression = re.sub(' OR ', ' | ', working_expression, flags=re.I)
-    working_expression = re.sub(' NOT ', ' ! ', working_expression, flags=re.I)
-    working_expression = re.sub(' <> ', ' ^ ', working_expression, flags=re.I)
+    working_expression = and_re.sub(' & ', working_expression)
+    working_expression = or_re.sub(' | ', working_expression)
+    working_expression = not_re.sub(' ! ', working_expression)
+    working_expression = working_expression.replace(' <> ', ' ^ ')
 
     working_expression = working_expression.replace('(', ' ( ').replace (')', ' ) ')
     tokens = [token.upper() for token in working_expression.split()]
-    for token in tokens:
-      match token:
-        case 'MAJOR':
-          sentence += 'MAJ'
-        case 'MINOR':
-          sentence += 'MIN'
-        case 'CONC':
-          sentence += 'CON'
-        case '&':
-          sentence += ' || ' if de_morgan else ' && '
-        case '|':
-          sentence += ' && ' if de_morgan else ' || '
-        case '!':
-          # NOT is not expected here
-          exit('Unexpected NOT in mogrify_expression()')
-          sentence += '-not- '
-        case '=':
-          sentence += ' != ' if de_morgan else ' == '
-        case '^':
-          sentence += ' == ' if de_morgan else ' != '
-        case '(' | ')':
-          sentence += token
-        case _:
-          sentence += f'{token}'
-
-  return sentence.strip()
+    if '!' in tokens:
+      # NOT is not expected here
+      exit('Unexpected NOT in mogrify_expression()')
+    symbols = de_morgan_symbols if de_morgan else expression_symbols
+    sentence = ''.join([symbols.get(token, token) for token in tokens])
+  sentence = sentence.strip()
+  _mogrified_expressions[expression_key] = sentence
+
+  return sentence
 
 
 if __name__ == '__main__':
@@ -22,6 +22,9 @@ def dict_factory():
 
 _courses_cache = defaultdict(dict_factory)
 
+# Expansions of wildcards and ranges, keyed by (institution, discipline, catalog_number)
+_expansions_cache = dict()
+
 CourseTuple = namedtuple('CourseTuple', 'course_id offer_nbr discipline catalog_number '
                          'course_title credits designation career')
 
@@ -42,9 +45,12 @@ def courses_cache(institution: str, discipline: str, catalog_number: str) -> lis
       Each institution’s courses are added to the cache the first time the institution is
       encountered.
 
+      The same wildcards and ranges get scribed over and over, so each one is expanded just once.
+      Callers must not modify the list returned.
+
       Returns a possibly-empty list of CourseTuples.
   """
-  if institution not in _courses_cache.keys():
+  if institution not in _courses_cache:
     with psycopg.connect('dbname=cuny_curriculum') as conn:
       with conn.cursor(row_factory=namedtuple_row) as cursor:
         cursor.execute("""
@@ -84,10 +90,16 @@ def courses_cache(institution: str, discipline: str, catalog_number: str) -> lis
     except KeyError:
       return []
 
+  expansion_key = (institution, discipline, catalog_number)
+  try:
+    return _expansions_cache[expansion_key]
+  except KeyError:
+    pass
+
   # Generate list of matching disciplines
   if '@' in discipline:
     regex = f'^{discipline}$'.replace('@', '.+')
-    disciplines = [key for key in _courses_cache[institution].keys() if re.match(regex, key)]
+    disciplines = [key for key in _courses_cache[institution] if re.match(regex, key)]
   else:
     disciplines = [discipline]
 
@@ -108,7 +120,7 @@ def courses_cache(institution: str, discipline: str, catalog_number: str) -> lis
 
   return_list = []
   for discipline in disciplines:
-    for cat_num in _courses_cache[institution][discipline].keys():
+    for cat_num in _courses_cache[institution][discipline]:
       if re.match(regex, cat_num):
         return_list.append(_courses_cache[institution][discipline][cat_num])
       elif low_val is not None:
@@ -118,6 +130,7 @@ def courses_cache(institution: str, discipline: str, catalog_number: str) -> lis
             return_list.append(_courses_cache[institution][discipline][cat_num])
         except ValueError:
           pass
+  _expansions_cache[expansion_key] = return_list
 
   return return_list
 
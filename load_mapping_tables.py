@@ -6,23 +6,137 @@ example.
 """
 
 import argparse
-import csv
-import os
 import sys
 import psycopg
 
-from collections import namedtuple
-from datetime import date
+from collections.abc import Callable
+from course_mapper_paths import reports_dir
 from pathlib import Path
-from psycopg.rows import namedtuple_row
 from time import time
 
 
-def _count_generator(reader):
-    b = reader(1024 * 1024)
-    while b:
-        yield b
-        b = reader(1024 * 1024)
+schema_name = 'course_mapper'
+
+
+# create_tables()
+# -------------------------------------------------------------------------------------------------
+def create_tables(conn: psycopg.Connection):
+  """(Re-)create the three course mapping tables.
+
+  Used here before loading the CSV files, and by course_mapper.py when it copies its output
+  directly into the db.
+  """
+  with conn.cursor() as cursor:
+    cursor.execute(f'create schema if not exists {schema_name}')
+    cursor.execute(f"""
+    drop table if exists {schema_name}.dgw_programs,
+                         {schema_name}.dgw_requirements,
+                         {schema_name}.dgw_courses;""")
+
+    cursor.execute(f"""
+    create table {schema_name}.dgw_programs (
+      institution     text,
+      requirement_id  text,
+      type            text,
+      code            text,
+      title           text,
+      total_credits   jsonb,
+      max_transfer    jsonb,
+      min_residency   jsonb,
+      min_grade       jsonb,
+      min_gpa         jsonb,
+      other           jsonb,
+      generate_date   date,
+      primary key (institution, requirement_id))
+    """)
+    conn.commit()
+
+    cursor.execute(f"""
+    create table {schema_name}.dgw_requirements (
+      institution           text,
+      plan_name             text,
+      plan_type             text,
+      subplan_name          text,
+      requirement_ids       text,
+      conditions            text,
+      requirement_key       integer primary key,
+      program_name          text,
+      context               jsonb,
+      generate_date         date
+    )""")
+    conn.commit()
+
+    cursor.execute(f"""
+    create table {schema_name}.dgw_courses (
+      requirement_key  integer, -- references dgw_requirements: see finish_tables()
+      course_id        text,
+      career           text,
+      course           text,
+      with_exp         jsonb,
+      generate_date    date,
+      primary key (requirement_key, course_id, with_exp)
+    )""")
+
+    cursor.execute(f"""
+      update updates set update_date = CURRENT_DATE
+       where table_name = '{schema_name}'
+      """)
+
+
+# copy_into_table()
+# -------------------------------------------------------------------------------------------------
+def copy_into_table(cursor: psycopg.Cursor, table_name: str,
+                    write_rows: Callable[[psycopg.Copy], None], copy_options: str = '') -> int:
+  """COPY rows into one of the course mapping tables, skipping duplicate keys.
+
+  The rows are COPYed into a temporary table that has no constraints, then inserted into the real
+  table from there in one statement, so a duplicate key costs only the duplicate row, not the whole
+  COPY. The skipped rows, if any, are reported on stderr.
+
+  write_rows(copy) writes the rows, and copy_options are the options for the COPY statement.
+  Used here for the CSV files, and by course_mapper.py when it copies its output directly into the
+  db. Returns the number of rows COPYed.
+  """
+  load_table = f'{table_name}_load'
+  cursor.execute(f'create temporary table {load_table} (like {schema_name}.{table_name})')
+  with cursor.copy(f'copy {load_table} from stdin {copy_options}') as copy:
+    write_rows(copy)
+  num_rows = cursor.rowcount
+
+  cursor.execute(f"""insert into {schema_name}.{table_name} select * from {load_table}
+                     on conflict do nothing
+                  """)
+  if (num_skipped := num_rows - cursor.rowcount) > 0:
+    # The skipped rows are the ones not in the table now. (A skipped row identical to one a
+    # previous call put in the table is counted, but not listed.)
+    cursor.execute(f"""select * from {load_table}
+                      except all
+                      select * from {schema_name}.{table_name}
+                   """)
+    print(f'{table_name} {num_skipped:,} duplicate rows skipped', file=sys.stderr)
+    print('\n'.join(f'{table_name} {list(row)}' for row in cursor), file=sys.stderr)
+  cursor.execute(f'drop table {load_table}')
+
+  return num_rows
+
+
+# finish_tables()
+# -------------------------------------------------------------------------------------------------
+def finish_tables(conn: psycopg.Connection):
+  """Add the dgw_courses foreign key, and analyze the three course mapping tables, once they have
+  been loaded.
+
+  Checking the foreign key for the whole table at once is much faster than checking it for each row
+  as the rows are loaded.
+  """
+  with conn.cursor() as cursor:
+    cursor.execute(f"""
+    alter table {schema_name}.dgw_courses
+      add foreign key (requirement_key) references {schema_name}.dgw_requirements
+    """)
+    cursor.execute(f"""
+    analyze {schema_name}.dgw_programs, {schema_name}.dgw_requirements, {schema_name}.dgw_courses
+    """)
 
 
 if __name__ == '__main__':
@@ -31,99 +145,34 @@ if __name__ == '__main__':
   args = parser.parse_args()
 
   session_start = time()
-  csv.field_size_limit(sys.maxsize)
 
-  schema_name = 'course_mapper'
   with psycopg.connect('dbname=cuny_curriculum') as conn:
-    with conn.cursor(row_factory=namedtuple_row) as cursor:
-      cursor.execute(f'create schema if not exists {schema_name}')
-      cursor.execute(f"""
-      drop table if exists {schema_name}.dgw_programs,
-                           {schema_name}.dgw_requirements,
-                           {schema_name}.dgw_courses;""")
-
-      cursor.execute(f"""
-      create table {schema_name}.dgw_programs (
-        institution     text,
-        requirement_id  text,
-        type            text,
-        code            text,
-        title           text,
-        total_credits   jsonb,
-        max_transfer    jsonb,
-        min_residency   jsonb,
-        min_grade       jsonb,
-        min_gpa         jsonb,
-        other           jsonb,
-        generate_date   date,
-        primary key (institution, requirement_id))
-      """)
-      conn.commit()
-
-      cursor.execute(f"""
-      create table {schema_name}.dgw_requirements (
-        institution           text,
-        plan_name             text,
-        plan_type             text,
-        subplan_name          text,
-        requirement_ids       text,
-        conditions            text,
-        requirement_key       integer primary key,
-        program_name          text,
-        context               jsonb,
-        generate_date         date
-      )""")
-      conn.commit()
-
-      cursor.execute(f"""
-      create table {schema_name}.dgw_courses (
-        requirement_key  integer references {schema_name}.dgw_requirements,
-        course_id        text,
-        career           text,
-        course           text,
-        with_exp         jsonb,
-        generate_date    date,
-        primary key (requirement_key, course_id, with_exp)
-      )""")
-
-      cursor.execute(f"""
-        update updates set update_date = CURRENT_DATE
-         where table_name = '{schema_name}'
-        """)
-
+    create_tables(conn)
+    with conn.cursor() as cursor:
       tables = dict()
-      reports_dir = Path(Path.home(), 'Projects/course_mapper/reports')
       # Sequence the tables to get the foreign key constraints in correct order
       for table_name in ['dgw_programs', 'dgw_requirements', 'dgw_courses']:
         file = Path(reports_dir, f'{table_name}.csv')
-        with open(file, 'rb') as fp:
-          c_generator = _count_generator(fp.raw.read)
-          num_lines = sum(buffer.count(b'\n') for buffer in c_generator)
         if args.progress:
           print()
-        print(f'{file.name:>20}: {num_lines:7,} lines')
-        tables[table_name] = num_lines - 1
-        nl = num_lines / 100.0
-        with open(file) as csv_file:
-          reader = csv.reader(csv_file)
-          for line in reader:
-            if args.progress:
-              print(f'\r{reader.line_num:,}/{num_lines:,} {round(reader.line_num/nl)}%', end='')
-            if reader.line_num == 1:
-              Row = namedtuple('Row', [col.lower().replace(' ', '_').replace('with', 'with_exp')
-                               for col in line])
-              field_names = Row._fields
-              fields = ',\n'.join([f'{field_name} text' for field_name in field_names])
-            else:
-              row = Row._make(line)
-              row_dict = row._asdict()
-              values = [value.replace('\'', '’') for value in row_dict.values()]
-              values_arg = ','.join([f"'{value}'" for value in values])
-              cursor.execute(f"""insert into {schema_name}.{table_name} values({values_arg})
-                              on conflict do nothing
-                              """)
-              if cursor.rowcount == 0:
-                print(f'{table_name} {values}', file=sys.stderr)
+        print(f'{file.name:>20}: {file.stat().st_size:11,} bytes')
+
+        # The CSV files are written by csv.writer, so the server can parse them itself: just pump the
+        # bytes through. An unquoted empty field is an empty string, not NULL, as it was when the
+        # rows were parsed here.
+        num_bytes = file.stat().st_size / 100.0
+
+        def write_file(copy: psycopg.Copy):
+          with open(file, 'rb') as csv_file:
+            while buffer := csv_file.read(1 << 20):
+              copy.write(buffer)
+              if args.progress:
+                print(f'\r{round(csv_file.tell() / num_bytes)}%', end='')
+
+        tables[table_name] = copy_into_table(cursor, table_name, write_file,
+                                             "(format csv, header true, null '\\N')")
+
+    finish_tables(conn)
 
   for key, value in tables.items():
     print(f'{key:>20}: {value:7,} rows')
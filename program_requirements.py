@@ -17,22 +17,25 @@ there is only one).
 """
 
 import psycopg
+import re
 import sys
 
 from markdown import markdown
 from pathlib import Path
 from psycopg.rows import namedtuple_row
 
-institutions = dict()
-with psycopg.connect('dbname=cuny_curriculum') as conn:
-  with conn.cursor(row_factory=namedtuple_row) as cursor:
-    cursor.execute("""
-    select code, name
-      from cuny_institutions
-      where associates or bachelors
-    """)
-    for row in cursor:
-      institutions[row.code] = row.name
+# A requirement_id, with or without its RA prefix and leading zeros
+requirement_id_re = re.compile(r'^(?:RA)?(\d+)$', re.I)
+
+# One connection for all the lookups this utility does
+conn = psycopg.connect('dbname=cuny_curriculum', autocommit=True)
+
+with conn.cursor() as cursor:
+  institutions = dict(cursor.execute("""
+  select code, name
+    from cuny_institutions
+    where associates or bachelors
+  """).fetchall())
 
 
 def format_program(institution: str,
@@ -40,19 +43,18 @@ def format_program(institution: str,
                    subplan_code: str,
                    show_courses: bool) -> str:
   """Return Markdown-encoded description of a program’s (or subprogam’s) requirements."""
-  with psycopg.connect('dbname=cuny_curriculum') as conn:
-    with conn.cursor(row_factory=namedtuple_row) as cursor:
-      cursor.execute("""
-      select * from course_mapper.programs
-       where institution = %s
-         and code = %s
-      """, (institution[0:3], program_code))
-      assert cursor.rowcount == 1
-      row = cursor.fetchone()
-      program_name = row.title
-
-      markdown_str = f'#{program_name} at {institutions[institution]}\n'
-      markdown_str += f'##{row.requirement_id}\n'
+  with conn.cursor(row_factory=namedtuple_row) as cursor:
+    cursor.execute("""
+    select title, requirement_id from course_mapper.programs
+     where institution = %s
+       and code = %s
+    """, (institution[0:3], program_code), prepare=True)
+    assert cursor.rowcount == 1
+    row = cursor.fetchone()
+    program_name = row.title
+
+    markdown_str = f'#{program_name} at {institutions[institution]}\n'
+    markdown_str += f'##{row.requirement_id}\n'
 
   return markdown_str
 
@@ -68,7 +70,6 @@ def do_program(institution: str, program_code: str, show_courses: bool) -> str:
 
 
 if __name__ == '__main__':
-  conn = psycopg.connect('dbname=cuny_curriculum')
   cursor = conn.cursor(row_factory=namedtuple_row)
   html_dir = Path('./html')
   institution = None
@@ -105,7 +106,9 @@ if __name__ == '__main__':
             prompt_str = error_prompt
             continue
           try:
-            requirement_id = f"RA{int(requirement_id.upper().strip('RA')):06}"
+            if not (match := requirement_id_re.match(requirement_id.strip())):
+              raise ValueError
+            requirement_id = f'RA{int(match[1]):06}'
             if institution is None:
               print('No institution')
               continue
@@ -116,7 +119,7 @@ if __name__ == '__main__':
                and r.requirement_id = %s
                and p.institution = %s
                and p.requirement_id = r.requirement_id
-            """, (institution, requirement_id, institution[0:3]))
+            """, (institution, requirement_id, institution[0:3]), prepare=True)
             if cursor.rowcount == 0:
               print(f'{requirement_id} is not an active program block at '
                     f'{institutions[institution]}')
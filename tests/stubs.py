@@ -0,0 +1,59 @@
+#! /usr/local/bin/python3
+"""Stand-ins for the modules the course mapper imports that need a db or the reports directory.
+
+The stand-ins are installed in sys.modules while the course mapper modules are (re-)imported, so
+the tests need neither a database nor a reports directory.
+"""
+import io
+import sys
+
+from importlib import import_module
+from pathlib import Path
+from types import ModuleType
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def stub_modules() -> dict:
+  """Stand-ins for the modules course_mapper imports that need a db or the reports directory."""
+  psycopg = ModuleType('psycopg')
+  psycopg.Connection = psycopg.Cursor = psycopg.Copy = object
+  psycopg.connect = mock.MagicMock()
+  psycopg_rows = ModuleType('psycopg.rows')
+  psycopg_rows.dict_row = psycopg_rows.namedtuple_row = None
+  psycopg.rows = psycopg_rows
+
+  activeplans = ModuleType('activeplans')
+  activeplans.active_plans = list
+  catalogyears = ModuleType('catalogyears')
+  catalogyears.catalog_years = mock.MagicMock()
+  dgw_parser = ModuleType('dgw_parser')
+  dgw_parser.parse_block = mock.MagicMock()
+  quarantine_manager = ModuleType('quarantine_manager')
+  quarantine_manager.QuarantineManager = mock.MagicMock
+
+  files = ModuleType('course_mapper_files')
+  file_names = ['anomaly_file', 'blocks_file', 'conditions_file', 'fail_file', 'label_file',
+                'log_file', 'no_courses_file', 'subplans_file', 'todo_file', 'programs_file',
+                'requirements_file', 'mapping_file']
+  for file_name in file_names:
+    setattr(files, file_name, io.StringIO())
+  files.report_files = [getattr(files, file_name) for file_name in file_names[:9]]
+
+  return {'psycopg': psycopg, 'psycopg.rows': psycopg_rows, 'activeplans': activeplans,
+          'catalogyears': catalogyears, 'dgw_parser': dgw_parser,
+          'quarantine_manager': quarantine_manager, 'course_mapper_files': files}
+
+
+def import_stubbed(module_name: str) -> tuple:
+  """Import one of the course mapper modules with the stand-ins in place.
+
+  Returns the module and the patcher that installed the stand-ins: stop the patcher when done.
+  """
+  patcher = mock.patch.dict(sys.modules, stub_modules())
+  patcher.start()
+  for stubbed_module_name in ['course_mapper', 'course_mapper_utils', 'coursescache',
+                              'load_mapping_tables']:
+    sys.modules.pop(stubbed_module_name, None)
+  return import_module(module_name), patcher
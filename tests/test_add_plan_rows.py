@@ -0,0 +1,66 @@
+#! /usr/local/bin/python3
+"""Tests for course_mapper.add_plan_rows(), which merges the rows returned by worker processes."""
+import unittest
+
+from itertools import count
+from stubs import import_stubbed
+
+
+def program_row(requirement_id: str) -> list:
+  return ['QNS', requirement_id, 'MAJOR', 'ENGL-BA', 'English', '[]', '[]', '[]', '[]', '[]', '{}',
+          '2026-10-15']
+
+
+def requirement_row(requirement_key: int, requirement_name: str) -> list:
+  return ['QNS01', 'ENGL-BA', 'MAJ', '', 'RA000001', '', requirement_key, requirement_name, '[]',
+          '2026-10-15']
+
+
+def map_row(requirement_key: int, course_id: str) -> list:
+  return [requirement_key, course_id, 'UGRD', f'ENGL {course_id}', '{}', '2026-10-15']
+
+
+class TestAddPlanRows(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.course_mapper, cls.patcher = import_stubbed('course_mapper')
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.patcher.stop()
+
+  def setUp(self):
+    self.course_mapper.requirement_keys = count(1)
+    self.course_mapper.program_blocks.clear()
+    for rows in [self.course_mapper.program_rows, self.course_mapper.requirement_rows,
+                 self.course_mapper.map_rows]:
+      rows.clear()
+
+  def test_two_workers(self):
+    """Overlapping worker key ranges get renumbered, and a shared program block is entered once."""
+    # Each worker numbers its requirements from 1, and both reach block RA000009.
+    worker_a = ([program_row('RA000001'), program_row('RA000009')],
+                [requirement_row(1, 'A1'), requirement_row(2, 'A2')],
+                [map_row(1, '000101'), map_row(2, '000102'), map_row(2, '000103')])
+    worker_b = ([program_row('RA000002'), program_row('RA000009')],
+                [requirement_row(1, 'B1'), requirement_row(2, 'B2')],
+                [map_row(1, '000201'), map_row(2, '000202')])
+    self.course_mapper.add_plan_rows(*worker_a)
+    self.course_mapper.add_plan_rows(*worker_b)
+
+    requirement_keys = [row[6] for row in self.course_mapper.requirement_rows]
+    self.assertEqual(len(set(requirement_keys)), 4)
+
+    requirement_names = {row[6]: row[7] for row in self.course_mapper.requirement_rows}
+    course_requirements = {row[1]: requirement_names[row[0]]
+                           for row in self.course_mapper.map_rows}
+    self.assertEqual(course_requirements, {'000101': 'A1', '000102': 'A2', '000103': 'A2',
+                                           '000201': 'B1', '000202': 'B2'})
+
+    program_ids = [row[1] for row in self.course_mapper.program_rows]
+    self.assertEqual(program_ids, ['RA000001', 'RA000009', 'RA000002'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+#! /usr/local/bin/python3
+"""Tests for load_mapping_tables.copy_into_table()'s reporting of skipped rows."""
+import io
+import unittest
+
+from contextlib import contextmanager, redirect_stderr
+from stubs import import_stubbed
+
+
+class FakeCopy:
+  """Collects the rows written to a COPY."""
+
+  def __init__(self):
+    self.rows = []
+
+  def write_row(self, row):
+    self.rows.append(row)
+
+
+class FakeCursor:
+  """Records the statements executed, and answers them as a db with num_inserted rows would."""
+
+  def __init__(self, num_inserted: int, skipped_rows: list):
+    self.num_inserted = num_inserted
+    self.skipped_rows = skipped_rows
+    self.statements = []
+    self.rowcount = -1
+
+  def execute(self, statement: str):
+    self.statements.append(statement)
+    self.rowcount = self.num_inserted if statement.lstrip().startswith('insert') else -1
+
+  @contextmanager
+  def copy(self, statement: str):
+    self.statements.append(statement)
+    copy = FakeCopy()
+    yield copy
+    self.rowcount = len(copy.rows)
+
+  def __iter__(self):
+    return iter(self.skipped_rows)
+
+
+def write_rows(copy: FakeCopy):
+  for row in [[1, '000101'], [1, '000101'], [2, '000102']]:
+    copy.write_row(row)
+
+
+class TestCopyIntoTable(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.load_mapping_tables, cls.patcher = import_stubbed('load_mapping_tables')
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.patcher.stop()
+
+  def test_nothing_skipped(self):
+    """When every row is inserted, the skipped rows aren't looked for."""
+    cursor = FakeCursor(num_inserted=3, skipped_rows=[])
+    stderr = io.StringIO()
+    with redirect_stderr(stderr):
+      num_rows = self.load_mapping_tables.copy_into_table(cursor, 'dgw_courses', write_rows)
+
+    self.assertEqual(num_rows, 3)
+    self.assertFalse(any('except all' in statement for statement in cursor.statements))
+    self.assertEqual(stderr.getvalue(), '')
+
+  def test_duplicate_skipped(self):
+    """A skipped duplicate is counted and listed."""
+    cursor = FakeCursor(num_inserted=2, skipped_rows=[(1, '000101')])
+    stderr = io.StringIO()
+    with redirect_stderr(stderr):
+      num_rows = self.load_mapping_tables.copy_into_table(cursor, 'dgw_courses', write_rows)
+
+    self.assertEqual(num_rows, 3)
+    self.assertEqual(stderr.getvalue(), "dgw_courses 1 duplicate rows skipped\n"
+                                        "dgw_courses [1, '000101']\n")
+    self.assertTrue(cursor.statements[-1].startswith('drop table'))
+
+
+if __name__ == '__main__':
+  unittest.main()
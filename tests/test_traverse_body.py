@@ -0,0 +1,49 @@
+#! /usr/local/bin/python3
+"""Tests for course_mapper.traverse_body()."""
+import unittest
+
+from stubs import import_stubbed
+
+
+class TestTraverseBody(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.course_mapper, cls.patcher = import_stubbed('course_mapper')
+    cls.course_mapper.do_remarks = True
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.patcher.stop()
+
+  def test_non_block_context_last(self):
+    """The containing block is found when the innermost context item is not a block."""
+    block_info = {'institution': 'QNS01', 'requirement_id': 'RA000123', 'block_type': 'MAJOR',
+                  'block_value': 'ENGL-BA', 'block_title': 'English'}
+    context_list = [{'block_info': block_info}, {'requirement_name': 'Group'}]
+    log_file = self.course_mapper.log_file
+    log_file.seek(0)
+    log_file.truncate()
+
+    self.course_mapper.traverse_body({'noncourse': {'label': 'Noncourse'}}, context_list)
+
+    self.assertEqual(log_file.getvalue(), 'QNS01 RA000123 Body noncourse (ignored)\n')
+
+  def test_shared_log_only_node(self):
+    """A log-only node shared by two blocks, as through copy_rules, is logged for each block."""
+    node = {'noncourse': {'label': 'Shared Noncourse'}}
+    log_file = self.course_mapper.log_file
+    log_file.seek(0)
+    log_file.truncate()
+
+    for requirement_id in ['RA000456', 'RA000789', 'RA000456']:
+      block_info = {'institution': 'QNS01', 'requirement_id': requirement_id,
+                    'block_type': 'MAJOR', 'block_value': 'ENGL-BA', 'block_title': 'English'}
+      self.course_mapper.traverse_body(node, [{'block_info': block_info}])
+
+    self.assertEqual(log_file.getvalue(), 'QNS01 RA000456 Body noncourse (ignored)\n'
+                                          'QNS01 RA000789 Body noncourse (ignored)\n')
+
+
+if __name__ == '__main__':
+  unittest.main()